@@ -1,24 +1,171 @@
+import json
 import logging
+from threading import Lock
+from time import perf_counter
 from urllib.parse import urlsplit, urljoin
-from requests import get
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+from .metrics import endpoint_pattern
+from .scheduler import RequestScheduler, RetryableError
+
+
+l = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """Raised if one of our services answers a request with an unexpected status code."""
+    def __init__(self, status_code, url):
+        super().__init__('Error {} when requesting {}.'.format(status_code, url))
+        self.status_code = status_code
+        self.url = url
+
 
 #TODO: move this somewhere sensible
 #TODO: useful error handling (CLI...)
 class HTTPClient:
-    def __init__(self, base, user=None, password=None):
+    """
+    Talks to a single Atlassian service.
+    Keeps a pool of persistent (keep-alive) connections,
+    so it can be shared by concurrent workers without a new TCP and TLS handshake per request.
+    All requests go through a RequestScheduler, which retries transient failures and throttles us.
+    """
+    RETRY_STATUS_CODES = {429, 502, 503, 504}
+    """Status codes telling us to try again later"""
+
+    DEFAULT_TIMEOUT = 60
+    """Seconds to wait for a connection or for data from the server before giving up on a request"""
+
+    def __init__(self, base, user=None, password=None, pool_size=10, cache=None, scheduler=None, metrics=None,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param base: base URL of the service
+        :param pool_size: number of connections to keep open; should be at least the number of concurrent workers
+        :param cache: optional ResponseCache for GET requests
+        :param scheduler: RequestScheduler to send requests with; share one between all clients of a run.
+                          Default: a scheduler of our own that retries but doesn't throttle.
+        :param metrics: optional ServiceMetrics to record every request in
+        :param timeout: seconds to wait for a connection or for data before retrying the request. None waits forever.
+        """
         self.base = base
         self.user = user
         self.password = password
+        self.cache = cache
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.metrics = metrics
+        self.timeout = timeout
+        self.host = urlsplit(base).netloc
+
+        self.session = Session()
+        if self.user is not None:
+            self.session.auth = (self.user, self.password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._adapter = adapter
+
+        self._lock = Lock()
+        self.requests = 0
+        """Number of requests sent by this client"""
+        self.bytes = 0
+        """Number of response body bytes received by this client"""
+        self.time = 0.0
+        """Seconds spent waiting for responses"""
+
+    @property
+    def reused_connections(self):
+        """Number of requests that were sent over an already open connection"""
+        reused = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                reused += pool.num_requests - pool.num_connections
+        return reused
+
+    @property
+    def stats(self):
+        return {'requests': self.requests,
+                'bytes': self.bytes,
+                'reused_connections': self.reused_connections,
+                'time': self.time}
 
     def get(self, url):
+        return self.request('GET', url)
+
+    def post(self, url, json=None):
+        return self.request('POST', url, json=json)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request relative to our base URL.
+        :return: decoded JSON response
+        """
         urlparts = urlsplit(url)
         request_url = urljoin(self.base, urlparts.path)
-        if urlparts.query is not None:
+        if urlparts.query:
             request_url += "?" + urlparts.query
 
-        if self.user is not None:
-            response = get(request_url, auth=(self.user, self.password))
-        else:
-            response = get(request_url)
-        assert response.status_code is 200, 'Error {} when requesting {}.'.format(response.status_code, request_url)
+        cached = None
+        if self.cache is not None and method == 'GET':
+            cached = self.cache.lookup(self.user, request_url)
+            if cached is not None:
+                if self.cache.is_fresh(cached):
+                    self.cache.hit(cached)
+                    if self.metrics is not None:
+                        self.metrics.record(method, endpoint_pattern(request_url, self.base), cached=True)
+                    return json.loads(cached.body)
+                kwargs['headers'] = cached.conditional_headers
+
+        response = self.scheduler.execute(self.host, lambda: self._send(method, request_url, **kwargs))
+
+        if response.status_code == 304 and cached is not None:
+            self.cache.hit(cached, revalidated=True)
+            return json.loads(cached.body)
+        if response.status_code != 200:
+            raise HTTPError(response.status_code, request_url)
+        if self.cache is not None and method == 'GET':
+            self.cache.store(self.user, request_url, response.text,
+                             response.headers.get('ETag'), response.headers.get('Last-Modified'))
         return response.json()
+
+    def _send(self, method, request_url, **kwargs):
+        """
+        Send a single request.
+        :raise RetryableError: if the request failed in a way worth retrying
+        """
+        start = perf_counter()
+        try:
+            response = self.session.request(method, request_url, timeout=self.timeout, **kwargs)
+        except (ConnectionError, Timeout) as e:
+            self._record(method, request_url, perf_counter() - start, error=True, retried=True)
+            raise RetryableError(e)
+        except Exception:
+            self._record(method, request_url, perf_counter() - start, error=True)
+            raise
+        elapsed = perf_counter() - start
+        size = len(response.content)
+        retry = response.status_code in self.RETRY_STATUS_CODES
+        self._record(method, request_url, elapsed, size,
+                     error=response.status_code not in (200, 304), retried=retry)
+
+        if retry:
+            raise RetryableError(HTTPError(response.status_code, request_url),
+                                 RetryableError.parse_retry_after(response.headers.get('Retry-After')),
+                                 overload=response.status_code in (429, 503))
+        return response
+
+    def _record(self, method, request_url, elapsed, size=0, error=False, retried=False):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.time += elapsed
+        if self.metrics is not None:
+            self.metrics.record(method, endpoint_pattern(request_url, self.base),
+                                latency=elapsed, size=size, error=error, retried=retried)
+
+    def close(self):
+        l.info('%s: %d requests, %d bytes, %d reused connections, %.1fs',
+               self.base, self.requests, self.bytes, self.reused_connections, self.time)
+        self.session.close()
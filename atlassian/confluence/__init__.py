@@ -2,6 +2,7 @@ import logging
 
 from ..service_model import Service, Project
 from .xmlrpc import ConfluenceXMLRPC
+from .rest import ConfluenceREST
 
 
 l = logging.getLogger(__name__)
@@ -13,9 +14,18 @@ class Confluence(Service):
     name = 'Confluence'
     space_permissions_supported_from = (5, 5) #TODO
 
-    def __init__(self, url, name=None, version=None):
+    APIS = {'xmlrpc': ConfluenceXMLRPC, 'rest': ConfluenceREST}
+    """Available API backends by name"""
+
+    def __init__(self, url, name=None, version=None, api='xmlrpc'):
         super().__init__(url, name, version)
-        self.api = ConfluenceXMLRPC(self)
+        if api not in self.APIS:
+            raise ValueError('Unknown Confluence API: {}'.format(api))
+        self.api = self.APIS[api](self)
+
+    @property
+    def max_concurrency(self):
+        return self.api.max_concurrency
 
     def login(self, user, password):
         self.api.login(user, password)
@@ -27,6 +37,18 @@ class Confluence(Service):
     def load_permissions_for_project(self, project_key):
         return self.api.load_permissions_for_project(project_key)
 
+    def load_group_members(self, group):
+        return self.api.load_group_members(group)
+
+    def change_marker(self, project):
+        """
+        Spaces whose permissions came with the listing are never carried over in incremental crawls:
+        their current permissions are at hand anyway, without another request.
+        """
+        if self.api.prefetched(project.key):
+            return None
+        return super().change_marker(project)
+
     def logout(self):
         self.api.logout()
-        super().logout()
\ No newline at end of file
+        super().logout()
@@ -0,0 +1,134 @@
+import logging
+from threading import Lock
+from urllib.parse import quote
+
+from .. import HTTPClient
+from ..service_model import Project
+from ..permission_data import PermissionEntry
+from .xmlrpc import convert_permission_sets
+
+
+l = logging.getLogger(__name__)
+
+
+class ConfluenceREST():
+    """
+    Talks to Confluence via its REST API, using a pooled HTTPClient that can be shared by concurrent workers.
+    Spaces are listed with their permissions expanded where the server supports it.
+    Permissions of all other spaces are loaded via JSON-RPC, which offers the same methods as the XML-RPC API
+    but works over plain HTTP. Note Confluence removes JSON-RPC together with XML-RPC, so servers without either
+    only work if they expand the permissions of all spaces.
+    """
+    max_concurrency = None
+
+    PAGE_LIMIT = 500
+    """Number of spaces we ask for per page. Confluence caps this at its own maximum anyway."""
+
+    OPERATIONS = {
+        ('read', 'space'): 'VIEWSPACE',
+        ('administer', 'space'): 'SETSPACEPERMISSIONS',
+        ('export', 'space'): 'EXPORTSPACE',
+        ('restrict_content', 'space'): 'SETPAGEPERMISSIONS',
+        ('delete', 'space'): 'REMOVEOWNCONTENT',
+        ('create', 'page'): 'EDITSPACE',
+        ('delete', 'page'): 'REMOVEPAGE',
+        ('create', 'blogpost'): 'EDITBLOG',
+        ('delete', 'blogpost'): 'REMOVEBLOG',
+        ('create', 'comment'): 'COMMENT',
+        ('delete', 'comment'): 'REMOVECOMMENT',
+        ('create', 'attachment'): 'CREATEATTACHMENT',
+        ('delete', 'attachment'): 'REMOVEATTACHMENT',
+        ('delete', 'mail'): 'REMOVEMAIL',
+    }
+    """Maps REST (operation, target type) pairs to the permission names used by the XML-RPC API"""
+
+    def __init__(self, generic):
+        self.generic = generic
+        self.client = None
+
+        self._prefetched = dict()
+        """Permissions that came with the space listing, by space key"""
+        self._lock = Lock()
+
+    def login(self, user, password):
+        self.client = HTTPClient(self.generic.url, user=user, password=password, **self.generic.client_options)
+
+    def logout(self):
+        """Return True on sucessful logout, False otherwise"""
+        if self.client is None:
+            return False
+        self.client.close()
+        self.client = None
+        return True
+
+    def load_projects(self):
+        url = 'rest/api/space?expand=permissions&limit={}'.format(self.PAGE_LIMIT)
+        patterns = self.generic.project_patterns
+        if patterns is not None and not any(c in pattern for pattern in patterns for c in '*?['):
+            keys = sorted({key for pattern in patterns for key in (pattern, pattern.upper())})  # we match case insensitively
+            url += ''.join('&spaceKey=' + quote(key) for key in keys)  # just ask for the spaces we want
+        start = 0
+        while True:
+            response = self.client.get('{}&start={}'.format(url, start))
+            results = response.get('results', [])
+            for space in results:
+                if not self.generic.wants_project(space['key']):
+                    continue
+                permissions = space.pop('permissions', None)
+                if permissions is not None:
+                    with self._lock:
+                        self._prefetched[space['key']] = permissions
+                yield Project(self.generic, space)
+            if 'next' not in response.get('_links', {}) or not results:
+                break
+            start += len(results)
+
+    def load_permissions_for_project(self, project_key):
+        with self._lock:
+            permissions = self._prefetched.pop(project_key, None)
+        if permissions is not None:
+            return self.convert_permissions(permissions)
+        return convert_permission_sets(self.get_permissions_for_space(project_key))
+
+    def prefetched(self, key):
+        """Whether the permissions of this space came with the space listing and are yet to be loaded"""
+        with self._lock:
+            return key in self._prefetched
+
+    def load_group_members(self, group):
+        members = []
+        start = 0
+        while True:
+            response = self.client.get('rest/api/group/{}/member?limit={}&start={}'.format(quote(group, safe=''), self.PAGE_LIMIT, start))
+            results = response.get('results', [])
+            members.extend(user.get('username') or user.get('accountId') for user in results)
+            if 'next' not in response.get('_links', {}) or not results:
+                break
+            start += len(results)
+        return members
+
+    def get_permissions_for_space(self, key):
+        """
+        Get permissions via JSON-RPC. No login token needed, as we authenticate every request.
+        """
+        permissions = self.client.post('rpc/json-rpc/confluenceservice-v2/getSpacePermissionSets', json=[key])
+        l.debug('get_permissions_for_space', extra={'key': key, 'permissions': permissions})
+        return permissions
+
+    @classmethod
+    def convert_permissions(cls, permissions):
+        """
+        Convert permissions from an expanded REST space listing to our internal permission data format.
+        Yield type is PermissionEntry.
+        """
+        for permission in permissions:
+            operation = permission.get('operation', {})
+            key = (operation.get('operation'), operation.get('targetType'))
+            name = cls.OPERATIONS.get(key, '{}_{}'.format(*key).upper())
+            if permission.get('anonymousAccess'):
+                yield PermissionEntry(name)  # like XML-RPC, which lists anonymous access without user or group
+            subjects = permission.get('subjects', {})
+            for user in subjects.get('user', {}).get('results', ()):
+                yield PermissionEntry(name, user.get('username') or user.get('accountId'), None)
+            for group in subjects.get('group', {}).get('results', ()):
+                yield PermissionEntry(name, None, group['name'])
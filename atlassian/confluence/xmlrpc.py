@@ -1,7 +1,11 @@
 from collections import defaultdict
 import logging
-from xmlrpc.client import Server
+from time import perf_counter
+from urllib.parse import urlsplit
+from xmlrpc.client import ProtocolError, SafeTransport, Server, Transport
 
+from .. import HTTPClient
+from ..scheduler import RequestScheduler, RetryableError
 from ..service_model import Project
 from ..permission_data import PermissionEntry
 
@@ -11,22 +15,28 @@ l = logging.getLogger(__name__)
 
 
 class ConfluenceXMLRPC():
+    max_concurrency = 1
+    """Our XML-RPC server proxy keeps a single connection and can't be shared between threads"""
 
     def __init__(self, generic):
         self.generic = generic
         self.token = None
         self.server = None
+        self.scheduler = None
 
     def login(self, user, password):
-        self.server = Server(self.generic.url + '/rpc/xmlrpc')
-        self.token = self.server.confluence1.login(user, password)
+        timeout = self.generic.client_options.get('timeout', HTTPClient.DEFAULT_TIMEOUT)
+        transport = timeout_transport(self.generic.url, timeout)
+        self.server = Server(self.generic.url + '/rpc/xmlrpc', transport=transport)
+        self.scheduler = self.generic.client_options.get('scheduler') or RequestScheduler()
+        self.token = self.call('login', user, password)
         assert self.token is not None, 'Login failed'
         return self.token
 
     def logout(self):
         """Return True on sucessful logout, False otherwise"""
         if self.token:
-            success = self.server.confluence1.logout(self.token)
+            success = self.call('logout', self.token)
         else:
             success = False
         self.token = None
@@ -34,43 +44,106 @@ class ConfluenceXMLRPC():
         return success
 
     def load_projects(self):
-        spaces = self.server.confluence1.getSpaces(self.token)
+        spaces = self.call('getSpaces', self.token)
         l.debug('get_spaces', extra={'spaces': spaces})
         for s in spaces:
             yield Project(self.generic, s)
 
+    def prefetched(self, key):
+        """Whether the permissions of this space came with the space listing. Never the case via XML-RPC."""
+        return False
+
     def get_permissions_for_space(self, key):
         """
         Get permissions from Confluence API
         """
-        permissions = self.server.confluence1.getSpacePermissionSets(self.token, key)
+        permissions = self.call('getSpacePermissionSets', self.token, key)
         l.debug('get_permissions_for_space', extra={'key': key, 'permissions': permissions})
         for p in permissions:
             yield dict(p)
 
+    def call(self, method, *args):
+        """
+        Call an XML-RPC method through our RequestScheduler, retrying if the server is overloaded or unreachable.
+        """
+        metrics = self.generic.client_options.get('metrics')
+
+        def record(start, **kwargs):
+            if metrics is not None:
+                metrics.record('XMLRPC', 'confluence1.' + method, latency=perf_counter() - start, **kwargs)
+
+        def send():
+            start = perf_counter()
+            try:
+                result = getattr(self.server.confluence1, method)(*args)
+            except ProtocolError as e:
+                retry = e.errcode in (429, 502, 503, 504)
+                record(start, error=True, retried=retry)
+                if retry:
+                    raise RetryableError(e, RetryableError.parse_retry_after(e.headers.get('Retry-After')),
+                                         overload=e.errcode in (429, 503))
+                raise
+            except OSError as e:
+                record(start, error=True, retried=True)
+                raise RetryableError(e)
+            except Exception:
+                record(start, error=True)
+                raise
+            record(start)
+            return result
+        return self.scheduler.execute(urlsplit(self.generic.url).netloc, send)
+
+    def load_group_members(self, group):
+        """The XML-RPC API can't list group members."""
+        return None
+
     def load_permissions_for_project(self, project_key):
         """
         Convert raw data to our internal permission data format
         """
-        for permission_set in self.get_permissions_for_space(project_key):
-            if 'spacePermissions' in permission_set:
-                for permission in permission_set['spacePermissions']:
-                    if 'type' in permission:
-                        type = permission['type']
-                    else:
-                        pass # TODO error
-
-                    if 'userName' in permission:
-                        user = permission['userName']
-                    else:
-                        user = None
-
-                    if 'groupName' in permission:
-                        group = permission['groupName']
-                    else:
-                        group = None
-                    yield PermissionEntry(permission['type'], user, group)
-            if set(permission_set.keys()) != {'spacePermissions', 'type'}:
-                l.debug('Got Confluence permission data that does not just include "spacePermissions": ' +
-                             str(permission_set))
+        return convert_permission_sets(self.get_permissions_for_space(project_key))
+
+
+def timeout_transport(url, timeout):
+    """
+    :return: An XML-RPC transport for url whose connections give up after timeout seconds without progress,
+             so a stalled server raises an OSError we retry instead of hanging forever
+    """
+    base = SafeTransport if url.startswith('https://') else Transport
+
+    class TimeoutTransport(base):
+        def make_connection(self, host):
+            connection = super().make_connection(host)
+            connection.timeout = timeout
+            return connection
+
+    return TimeoutTransport()
+
+
+def convert_permission_sets(permission_sets):
+    """
+    Convert Confluence space permission sets, as returned by getSpacePermissionSets,
+    to our internal permission data format.
+    Yield type is PermissionEntry.
+    """
+    for permission_set in permission_sets:
+        if 'spacePermissions' in permission_set:
+            for permission in permission_set['spacePermissions']:
+                if 'type' in permission:
+                    type = permission['type']
+                else:
+                    pass # TODO error
+
+                if 'userName' in permission:
+                    user = permission['userName']
+                else:
+                    user = None
 
+                if 'groupName' in permission:
+                    group = permission['groupName']
+                else:
+                    group = None
+                yield PermissionEntry(permission['type'], user, group)
+        if set(permission_set.keys()) != {'spacePermissions', 'type'}:
+            l.debug('Got Confluence permission data that does not just include "spacePermissions": ' +
+                         str(permission_set))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import BoundedSemaphore
+from urllib.parse import urlsplit
+
+
+l = logging.getLogger(__name__)
+
+
+class Crawler:
+    """
+    Loads permissions for all projects of all services of a MyLittleAtlassianWorld.
+    Services are crawled in parallel. Each service gets its own worker pool to load
+    per-project permissions with.
+    As every project builds its own PermissionDict, the result is identical to a serial crawl.
+    """
+
+    def __init__(self, workers=1, host_limit=None):
+        """
+        :param workers: maximum number of concurrent permission loads per service
+        :param host_limit: maximum number of concurrent permission loads per host,
+                           shared by all services running on the same host. None means no limit.
+                           Note this limits projects, not requests: services may load a project's permissions
+                           with several concurrent requests, e.g. Jira's role lookups.
+        """
+        self.workers = max(1, workers)
+        self.host_limit = host_limit
+
+        self._host_semaphores = dict()
+        """Maps host names to semaphores limiting the concurrent requests to this host"""
+
+    def crawl(self, world, previous=None):
+        """
+        Refresh all permissions of all services in world.
+        :param previous: an older MyLittleAtlassianWorld to crawl incrementally against, see MyLittleAtlassianWorld.refresh()
+        :rtype: None
+        """
+        services = list(world.services.items())
+        if not services:
+            return
+        self._prepare_host_semaphores(service for key, service in services)
+        with ThreadPoolExecutor(max_workers=len(services)) as service_pool:
+            futures = [service_pool.submit(self.crawl_service, service, world.previous_service(previous, key))
+                       for key, service in services]
+            for future in futures:
+                future.result()  # re-raise exceptions from our worker threads
+
+    def crawl_service(self, service, previous=None):
+        """
+        Refresh all permissions of a single service, using a worker pool of our configured size.
+        :param previous: an older copy of this service. If set, only reload new and changed projects.
+        :rtype: None
+        """
+        service.assert_logged_in()
+        service.refresh_projects()
+        if previous is None:
+            projects = list(service.projects.values())
+        else:
+            projects = service.carry_over_permissions(previous)
+
+        workers = self.workers_for(service)
+        l.info("Crawling %d projects of %s with %d workers.", len(projects), service.name, workers)
+        if workers == 1:
+            for project in projects:
+                self._refresh_project(service, project)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as project_pool:
+                futures = [project_pool.submit(self._refresh_project, service, project) for project in projects]
+                for future in futures:
+                    future.result()
+        service.finish_crawl()
+
+    def workers_for(self, service):
+        """
+        :return: The number of workers we may use for this service.
+                 Respects the service's own concurrency limit (e.g. for APIs that can't be shared between threads).
+        """
+        workers = self.workers
+        if service.max_concurrency is not None:
+            workers = min(workers, service.max_concurrency)
+        if self.host_limit is not None:
+            workers = min(workers, self.host_limit)
+        return max(1, workers)
+
+    def _prepare_host_semaphores(self, services):
+        self._host_semaphores = dict()
+        if self.host_limit is None:
+            return
+        for service in services:
+            host = self.host_of(service)
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = BoundedSemaphore(self.host_limit)
+
+    @staticmethod
+    def host_of(service):
+        return urlsplit(service.url).netloc
+
+    def _refresh_project(self, service, project):
+        semaphore = self._host_semaphores.get(self.host_of(service))
+        if semaphore is None:
+            project.refresh_permissions()
+        else:
+            with semaphore:
+                project.refresh_permissions()
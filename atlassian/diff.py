@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+
+class PermissionDiff:
+    """
+    Differences between two MyLittleAtlassianWorld objects, computed on their flat permissions.
+    All collections are sets of tuples, keyed by service key:
+      - added, removed: assignments as (service, project, permission, type, assignee)
+      - added_projects, removed_projects: (service, project)
+      - added_permissions, removed_permissions: (service, project, permission)
+    An assignment belonging to an added or removed project or permission is listed in added or removed as well.
+    """
+
+    ADDED = '+'
+    REMOVED = '-'
+
+    def __init__(self, old, new):
+        """
+        :param old: MyLittleAtlassianWorld to compare from
+        :param new: MyLittleAtlassianWorld to compare to
+        """
+        old_projects, old_permissions, old_assignments = self._collect(old)
+        new_projects, new_permissions, new_assignments = self._collect(new)
+
+        self.added = new_assignments - old_assignments
+        self.removed = old_assignments - new_assignments
+        self.added_projects = new_projects - old_projects
+        self.removed_projects = old_projects - new_projects
+        self.added_permissions = new_permissions - old_permissions
+        self.removed_permissions = old_permissions - new_permissions
+
+    @staticmethod
+    def _collect(world):
+        projects = set()
+        permissions = set()
+        assignments = set()
+        for service_key, service in world.services.items():
+            for project_key, project in service.projects.items():
+                projects.add((service_key, project_key))
+                for permission_name in project.permissions.keys():
+                    permissions.add((service_key, project_key, permission_name))
+                for assignment in project.permissions.flatten():
+                    assignments.add((service_key, project_key) + assignment)
+        return projects, permissions, assignments
+
+    def __bool__(self):
+        return bool(self.added or self.removed or
+                    self.added_projects or self.removed_projects or
+                    self.added_permissions or self.removed_permissions)
+
+    def __str__(self):
+        return "\n".join(self.lines()) if self else "No changes"
+
+    def lines(self):
+        """
+        Yield one line of text per change, sorted, e.g. "+ Jira / DEMO / Developers / User carol"
+        """
+        for change, service, project, permission, type, assignee in self.changes():
+            if type is None:
+                if permission is None:
+                    yield '{} {} / {} (project)'.format(change, service, project)
+                else:
+                    yield '{} {} / {} / {} (permission)'.format(change, service, project, permission)
+            else:
+                yield '{} {} / {} / {} / {} {}'.format(change, service, project, permission, type, assignee)
+
+    @property
+    def changed_projects(self):
+        """
+        :return: A set of (service, project) tuples for all projects containing any change
+        """
+        result = self.added_projects | self.removed_projects
+        for assignment in self.added | self.removed:
+            result.add(assignment[:2])
+        for permission in self.added_permissions | self.removed_permissions:
+            result.add(permission[:2])
+        return result
+
+    def by_project(self):
+        """
+        :return: A dict mapping (service, project) to a list of (change, permission, type, assignee) tuples
+                 for all changed assignments
+        """
+        result = defaultdict(list)
+        for change, assignments in ((self.ADDED, self.added), (self.REMOVED, self.removed)):
+            for service, project, permission, type, assignee in assignments:
+                result[(service, project)].append((change, permission, type, assignee))
+        return result
+
+    def changes(self):
+        """
+        Yield all changes sorted by service, project, permission, type and assignee,
+        as (change, service, project, permission, type, assignee) tuples.
+        change is ADDED or REMOVED. For added or removed projects and permissions,
+        the fields below the project or permission respectively are None.
+        """
+        records = []
+        for change, projects in ((self.ADDED, self.added_projects), (self.REMOVED, self.removed_projects)):
+            records.extend((change,) + project + (None, None, None) for project in projects)
+        for change, permissions in ((self.ADDED, self.added_permissions), (self.REMOVED, self.removed_permissions)):
+            records.extend((change,) + permission + (None, None) for permission in permissions)
+        for change, assignments in ((self.ADDED, self.added), (self.REMOVED, self.removed)):
+            records.extend((change,) + assignment for assignment in assignments)
+        yield from sorted(records, key=lambda r: (r[1:3], r[3] or '', r[4] or '', r[5] or '', r[0]))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Lock
+
+from . import HTTPError
+from .permission_data import principals
+
+
+l = logging.getLogger(__name__)
+
+
+class GroupMembership:
+    """
+    Members of all groups holding permissions in a MyLittleAtlassianWorld, to resolve effective permissions:
+    who actually has access, directly or through any of their groups.
+    Every group is looked up once per service, concurrently. Member sets are interned in the shared
+    principal table, so groups with identical members, e.g. in Jira and Stash connected to the same directory,
+    share a single set, and nothing is copied into projects.
+    """
+
+    def __init__(self, world, workers=4):
+        """
+        :param workers: number of concurrent group lookups per service
+        """
+        self.world = world
+        self.workers = workers
+
+        self._members = dict()
+        """Member frozensets by group name, by service key. None for groups we couldn't look up."""
+        self._groups_of = None
+        """Group names by user name, by service key. Built on first use."""
+        self._lock = Lock()
+
+    def load(self):
+        """
+        Look up the members of all groups holding any permission in our world, skipping groups we already know.
+        Services that can't list group members are skipped with a warning; their groups stay unresolved.
+        Groups that fail to load, e.g. because they were deleted since the crawl, are logged and get no members.
+        """
+        for service_key, service in sorted(self.world.services.items()):
+            groups = set()
+            for project in service.projects.values():
+                for entry in project.permissions.values():
+                    groups.update(entry.groups)
+            known = self._members.setdefault(service_key, dict())
+            missing = sorted(groups - set(known.keys()))
+            if not missing:
+                continue
+            workers = min(self.workers, service.max_concurrency or self.workers)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for group, members in zip(missing, pool.map(lambda group: self._load_members(service, group), missing)):
+                    known[group] = (principals.intern_set(principals.intern(member) for member in members)
+                                    if members is not None else None)
+            unresolved = sum(1 for group in missing if known[group] is None)
+            if unresolved:
+                l.warning("%s can't list group members; effective permissions will lack members of %d groups.",
+                          service.name, unresolved)
+            l.info('%s: looked up %d groups.', service.name, len(missing))
+        with self._lock:
+            self._groups_of = None
+
+    @staticmethod
+    def _load_members(service, group):
+        try:
+            return service.load_group_members(group)
+        except HTTPError as e:
+            l.warning("%s: couldn't look up members of group %s, assuming it has none: %s", service.name, group, e)
+            return []
+
+    def members(self, service_key, group):
+        """
+        :return: A frozenset of all users in group, or None if we couldn't look it up
+        """
+        return self._members.get(service_key, dict()).get(group)
+
+    def groups_of(self, service_key, user):
+        """
+        :return: A set of all groups of service user is a member of
+        """
+        with self._lock:
+            if self._groups_of is None:
+                self._groups_of = dict()
+                for key, groups in self._members.items():
+                    index = self._groups_of[key] = dict()
+                    for group, members in groups.items():
+                        for member in members or ():
+                            index.setdefault(member, set()).add(group)
+            return self._groups_of.get(service_key, dict()).get(user, set())
+
+    def effective_users(self, service_key, entry):
+        """
+        Yield (user, group) for everyone holding the PermissionEntry entry, sorted by user:
+        group is None for users granted the permission directly, else the first group that grants it to them.
+        Users granted the permission both directly and through groups are listed once, as direct.
+        Groups we couldn't look up follow as (None, group).
+        """
+        via = dict()
+        unresolved = []
+        for group in principals.sorted_names(entry.groups):
+            members = self.members(service_key, group)
+            if members is None:
+                unresolved.append(group)
+                continue
+            for user in members:
+                via.setdefault(user, group)
+        for user in entry.users:
+            via[user] = None
+        for user in sorted(via.keys()):
+            yield user, via[user]
+        for group in unresolved:
+            yield None, group
+
+    def effective_grants(self, user):
+        """
+        :return: A sorted list of (service key, project key, permission, group) of everything user can access.
+                 group is None for permissions granted to user directly, else a group of user granting it
+                 (the first one by name, if there are several).
+        """
+        index = self.world.permission_index
+        result = dict(((service, project, permission), None) for service, project, permission in index.user(user))
+        for service_key in sorted(self._members.keys()):
+            for group in sorted(self.groups_of(service_key, user)):
+                for service, project, permission in index.group(group):
+                    if service == service_key:
+                        result.setdefault((service, project, permission), group)
+        return sorted(grant + (group,) for grant, group in result.items())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from hashlib import sha256
+import json
+import logging
+import os
+from threading import Lock, get_ident
+from time import time
+
+
+l = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    __slots__ = ('key', 'url', 'body', 'etag', 'last_modified', 'stored')
+
+    def __init__(self, key, url, body, etag=None, last_modified=None, stored=None):
+        self.key = key
+        self.url = url
+        self.body = body
+        """Response body as text"""
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored = stored if stored is not None else time()
+        """When we last got this response from or confirmed it with the server"""
+
+    @property
+    def conditional_headers(self):
+        """Headers asking the server to only send this resource again if it changed"""
+        headers = dict()
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of GET responses, shared by all HTTPClients of a run.
+    Entries are keyed by URL and user, so users with different permissions never see each other's responses.
+    Entries younger than ttl are used without asking the server.
+    Older ones are revalidated using ETag / Last-Modified where the server sent those.
+    If the cache grows beyond max_size bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, ttl=3600, max_size=512 * 1024 * 1024):
+        """
+        :param directory: where to keep cached responses; created if missing
+        :param ttl: seconds a response may be used without revalidating it
+        :param max_size: maximum total size of all cached responses in bytes
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = Lock()
+        self._size = sum(os.path.getsize(path) for path in self._files())
+
+        self.hits = 0
+        """Responses served from cache without asking the server"""
+        self.revalidated = 0
+        """Responses served from cache after the server confirmed they're unchanged"""
+        self.misses = 0
+        """Responses we had to download"""
+
+    def key(self, user, url):
+        return sha256('{}\n{}'.format(user or '', url).encode('utf-8')).hexdigest()
+
+    def lookup(self, user, url):
+        """
+        :return: The cached CacheEntry for this URL and user, or None
+        """
+        key = self.key(user, url)
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as fd:
+                data = json.load(fd)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(key, data['url'], data['body'], data.get('etag'), data.get('last_modified'), data['stored'])
+
+    def is_fresh(self, entry):
+        return time() - entry.stored < self.ttl
+
+    def hit(self, entry, revalidated=False):
+        """
+        Count entry as served from cache. If the server just confirmed it, restart its TTL.
+        """
+        with self._lock:
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.hits += 1
+        if revalidated:
+            entry.stored = time()
+            self._write(entry)
+
+    def store(self, user, url, body, etag=None, last_modified=None):
+        """
+        Cache a freshly downloaded response.
+        """
+        with self._lock:
+            self.misses += 1
+        self._write(CacheEntry(self.key(user, url), url, body, etag, last_modified))
+
+    def log_stats(self):
+        l.info('HTTP cache: %d hits, %d revalidated, %d misses, %.1f MB in %s',
+               self.hits, self.revalidated, self.misses, self._size / 1024 / 1024, self.directory)
+
+    def _write(self, entry):
+        path = self._path(entry.key)
+        data = json.dumps({'url': entry.url, 'body': entry.body, 'etag': entry.etag,
+                           'last_modified': entry.last_modified, 'stored': entry.stored})
+        temp = '{}.{}.{}.tmp'.format(path, os.getpid(), get_ident())
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        with open(temp, 'w', encoding='utf-8') as fd:
+            fd.write(data)
+        os.replace(temp, path)
+        with self._lock:
+            self._size += os.path.getsize(path) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete least recently used entries until we're down to 90% of max_size. Call with self._lock held.
+        """
+        files = []
+        for path in self._files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        for mtime, path in sorted(files):
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _files(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                yield os.path.join(self.directory, name)
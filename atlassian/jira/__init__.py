@@ -1,7 +1,10 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from threading import Lock
+from urllib.parse import quote
 
-from .. import HTTPClient
+from .. import HTTPClient, HTTPError
 
 from ..service_model import Service, Project
 from ..permission_data import PermissionEntry
@@ -12,6 +15,27 @@ l = logging.getLogger(__name__)
 
 class Jira(Service):
     name = 'Jira'
+    role_workers = 4
+    """Number of role actor lookups per project to run concurrently"""
+    GROUP_PAGE_LIMIT = 50
+    """Number of group members we ask for per page. Jira caps this at 50 anyway."""
+
+    def __init__(self, url, name=None, version=None):
+        super().__init__(url, name, version)
+
+        self._roles = None
+        """
+        Cached role definitions, mapping role names to role IDs. Roles are global in Jira,
+        so we only need to look them up once instead of once per project.
+        False if this server can't list roles globally.
+        """
+
+        self._role_pool = None
+        """Thread pool to look up the actors of a project's roles with"""
+
+        self._lock = Lock()
+        self.requests_saved = 0
+        """Number of per-project role lookups we could skip thanks to the role definition cache"""
 
     @property
     def client(self):
@@ -21,20 +45,30 @@ class Jira(Service):
 
     def login(self, user, password):
         super().login(user, password)
-        self._data['client'] = HTTPClient(self.url, user=user, password=password)
+        options = dict(self.client_options)
+        options['pool_size'] = options.get('pool_size', 10) + self.role_workers  # room for our role lookups
+        self._data['client'] = HTTPClient(self.url, user=user, password=password, **options)
 
     def logout(self):
         # TODO logout of jira
-        del self._data['client']
+        if self._role_pool is not None:
+            self._role_pool.shutdown()
+            self._role_pool = None
+        if 'client' in self._data:
+            self._data.pop('client').close()
 
     def load_projects(self):
         for project in self.client.get('rest/api/2/project'):
             yield Project(self, project)
 
     def load_permissions_for_project(self, project_key):
-        roles = self.get_roles(project_key)
-        for name, url in roles.items():
-            role = self.client.get(url)
+        urls = self.get_role_urls(project_key)
+        if self._role_pool is None:
+            with self._lock:
+                if self._role_pool is None:
+                    self._role_pool = ThreadPoolExecutor(max_workers=self.role_workers)
+        roles = zip(urls.keys(), self._role_pool.map(self.client.get, urls.values()))
+        for name, role in roles:
             for actor in role.get('actors', ()):
                 if actor['type'] in 'atlassian-group-role-actor':
                     yield PermissionEntry(name, None, actor['name'])
@@ -44,5 +78,49 @@ class Jira(Service):
                     self.l.error('Could not match type "{}" to user or group'.format(actor['type']),
                                  extra={'actor': actor})
 
+    def load_group_members(self, group):
+        members = []
+        start = 0
+        while True:
+            response = self.client.get('rest/api/2/group/member?groupname={}&startAt={}&maxResults={}'.format(
+                quote(group), start, self.GROUP_PAGE_LIMIT))
+            values = response.get('values', [])
+            members.extend(user['name'] for user in values)
+            if response.get('isLast', True) or not values:
+                break
+            start += len(values)
+        return members
+
     def get_roles(self, projectkey):
-        return self.client.get('rest/api/2/project/{}/role'.format(projectkey))
\ No newline at end of file
+        return self.client.get('rest/api/2/project/{}/role'.format(projectkey))
+
+    def get_role_urls(self, projectkey):
+        """
+        :return: A dict mapping role names to the URL listing this project's actors for that role
+        """
+        roles = self.load_role_definitions()
+        if not roles:
+            return self.get_roles(projectkey)
+        with self._lock:
+            self.requests_saved += 1
+        return {name: 'rest/api/2/project/{}/role/{}'.format(projectkey, role_id) for name, role_id in roles.items()}
+
+    def load_role_definitions(self):
+        """
+        Look up all project roles once and cache them.
+        :return: A dict mapping role names to role IDs, or False if this Jira can't list roles globally
+        """
+        if self._roles is None:
+            with self._lock:
+                if self._roles is None:
+                    try:
+                        self._roles = {role['name']: role['id'] for role in self.client.get('rest/api/2/role')}
+                    except HTTPError as e:
+                        l.info("%s can't list project roles globally (error %d), looking them up per project.",
+                               self.name, e.status_code)
+                        self._roles = False
+        return self._roles
+
+    def finish_crawl(self):
+        if self.requests_saved:
+            l.info("%s: saved %d role lookup requests by caching role definitions.", self.name, self.requests_saved)
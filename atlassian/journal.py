@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoint journal for crawls.
+While crawling, every project is appended to the journal as soon as its permissions are loaded.
+If the crawl dies, a new crawl can resume from the journal and skip all projects recorded there.
+
+A journal is a line-delimited JSON file. The first line is a header naming the format and its version.
+Every following line is one self-contained project record:
+
+  [service class, service url, service name, project key, change marker, perms]
+
+with perms as a list of [permission, [users], [groups]].
+Lines are flushed after every project, but never rewritten, so a crash can at most cost the last line.
+"""
+
+import json
+import logging
+import os
+from threading import Lock
+
+from .service_model import MyLittleAtlassianWorld, Project
+from .permission_data import PermissionDict, PermissionEntry
+from .snapshot import SERVICE_CLASSES
+
+
+l = logging.getLogger(__name__)
+
+FORMAT = 'atlassian-permissions-journal'
+VERSION = 1
+
+
+class CrawlJournal:
+    """
+    Records finished projects. Register it as listener on all services before crawling,
+    see Service.add_listener().
+    """
+
+    def __init__(self, filename, append=False):
+        """
+        :param append: continue an existing journal instead of starting a new one
+        """
+        self.filename = filename
+        self._lock = Lock()
+        exists = append and os.path.exists(filename) and os.path.getsize(filename) > 0
+        complete = True
+        if exists:
+            with open(filename, 'rb') as fd:
+                fd.seek(-1, os.SEEK_END)
+                complete = fd.read(1) == b'\n'
+        self._file = open(filename, 'a' if append else 'w', encoding='utf-8')
+        if not exists:
+            self._write({'format': FORMAT, 'version': VERSION})
+        elif not complete:  # terminate the incomplete line a crash left behind, so it doesn't swallow our next record
+            self._file.write('\n')
+
+    def __call__(self, service, project):
+        permissions = [[name,
+                        sorted(project.permissions[name].users),
+                        sorted(project.permissions[name].groups)]
+                       for name in sorted(project.permissions.keys())]
+        self._write([service.__class__.__name__, service.url, service.name,
+                     project.key, project.change_marker, permissions])
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        """
+        Close and delete this journal, e.g. after the crawl finished successfully.
+        """
+        self.close()
+        os.remove(self.filename)
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:  # projects may finish loading on several worker threads at once
+            self._file.write(line)
+            self._file.flush()
+
+    @staticmethod
+    def read(filename):
+        """
+        Read all projects recorded in a journal.
+        Pass the result as previous world to MyLittleAtlassianWorld.refresh() to resume a crawl:
+        recorded projects whose change marker did not move since will be skipped.
+        An incomplete last line, as left by a crash, is ignored.
+        :rtype: MyLittleAtlassianWorld
+        """
+        services = dict()
+        with open(filename, 'r', encoding='utf-8') as fd:
+            header = json.loads(fd.readline())
+            if header.get('format') != FORMAT or header.get('version') != VERSION:
+                raise ValueError('{} is not a crawl journal this software can read'.format(filename))
+            for line in fd:
+                try:
+                    class_name, url, service_name, key, marker, permissions = json.loads(line)
+                except ValueError:
+                    l.warning('Ignoring incomplete journal line: %s', line)
+                    continue
+                if service_name not in services:
+                    services[service_name] = SERVICE_CLASSES[class_name](url, name=service_name)
+                    services[service_name]._projects = dict()
+                service = services[service_name]
+                project = Project(service, {'key': key})
+                project._change_marker = marker
+                project._permissions = PermissionDict()
+                for name, users, groups in permissions:
+                    project._permissions.add_permission(PermissionEntry(name, set(users), set(groups)))
+                project._permissions.compact()
+                service._projects[key] = project
+        l.info('Resuming from journal %s with %d finished projects.',
+               filename, sum(len(service._projects) for service in services.values()))
+        return MyLittleAtlassianWorld(services)
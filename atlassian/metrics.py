@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Request metrics for crawls: how many requests we sent to which endpoint of which service,
+how long they took, how much they transferred and how often they had to be retried.
+Endpoints are grouped by pattern, with project keys, repository slugs and the like replaced by {},
+e.g. rest/api/1.0/projects/{}/repos/{}/permissions/users.
+"""
+
+from bisect import bisect_left
+import json
+import logging
+from threading import Lock
+from urllib.parse import urlsplit
+
+
+l = logging.getLogger(__name__)
+
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Upper bounds of our latency histogram buckets in seconds. Everything slower goes into a final +Inf bucket."""
+
+PARAMETER_AFTER = {'projects', 'project', 'repos', 'role', 'space', 'group', 'groups', 'users', 'user'}
+"""Path segments following one of these are identifiers, not part of the endpoint, unless listed in ENDPOINT_NAMES"""
+
+ENDPOINT_NAMES = {'member', 'members', 'more-members', 'permissions', 'search', 'repos', 'role', 'users', 'groups'}
+"""Path segments that name an endpoint, even where they follow one of PARAMETER_AFTER, e.g. group/member"""
+
+
+def endpoint_pattern(url, base=''):
+    """
+    :param url: request URL
+    :param base: base URL of the service; stripped from url
+    :return: url's path relative to base, with identifiers replaced by {}
+    """
+    path = urlsplit(url).path
+    base_path = urlsplit(base).path
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    segments = [segment for segment in path.split('/') if segment]
+    for i in range(1, len(segments)):
+        if segments[i - 1] in PARAMETER_AFTER and segments[i] not in ENDPOINT_NAMES:
+            segments[i] = '{}'
+    return '/'.join(segments)
+
+
+class EndpointMetrics:
+    """Everything we measured for a single endpoint of a single service"""
+    __slots__ = ('requests', 'errors', 'retries', 'cached', 'bytes', 'time', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        """Requests sent, including retries"""
+        self.errors = 0
+        """Requests that failed, either with an unexpected status code or without any response"""
+        self.retries = 0
+        """Requests that failed and were retried"""
+        self.cached = 0
+        """Requests answered from our response cache without asking the server"""
+        self.bytes = 0
+        self.time = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, latency):
+        self.time += latency
+        self.buckets[bisect_left(BUCKETS, latency)] += 1
+
+    def quantile(self, q):
+        """
+        :return: Upper bound of the histogram bucket containing quantile q of all latencies,
+                 inf if that's the +Inf bucket, None if we have no latencies
+        """
+        total = sum(self.buckets)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {'requests': self.requests, 'errors': self.errors, 'retries': self.retries, 'cached': self.cached,
+                'bytes': self.bytes, 'seconds': round(self.time, 6),
+                'histogram': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.buckets))}
+
+
+class CrawlMetrics:
+    """
+    Collects request metrics of all services of a run. Thread safe.
+    Pass for_service(service name) as 'metrics' client option to a service, see Service.client_options.
+    """
+
+    def __init__(self):
+        self._endpoints = dict()
+        """EndpointMetrics by (service name, method, endpoint pattern)"""
+        self._lock = Lock()
+
+    def for_service(self, name):
+        return ServiceMetrics(self, name)
+
+    def record(self, service, method, endpoint, latency=None, size=0, error=False, retried=False, cached=False):
+        """
+        Record a single request.
+        :param latency: seconds until we had a response; None for requests answered from cache
+        :param size: bytes received
+        """
+        key = (service, method, endpoint)
+        with self._lock:
+            metrics = self._endpoints.get(key)
+            if metrics is None:
+                metrics = self._endpoints[key] = EndpointMetrics()
+            if cached:
+                metrics.cached += 1
+                return
+            metrics.requests += 1
+            metrics.bytes += size
+            if error:
+                metrics.errors += 1
+            if retried:
+                metrics.retries += 1
+            if latency is not None:
+                metrics.observe(latency)
+
+    def merge(self, items):
+        """
+        Add metrics measured elsewhere, e.g. in a worker process.
+        :param items: ((service name, method, endpoint pattern), EndpointMetrics) pairs, see items()
+        """
+        with self._lock:
+            for key, other in items:
+                metrics = self._endpoints.get(key)
+                if metrics is None:
+                    metrics = self._endpoints[key] = EndpointMetrics()
+                for name in ('requests', 'errors', 'retries', 'cached', 'bytes', 'time'):
+                    setattr(metrics, name, getattr(metrics, name) + getattr(other, name))
+                metrics.buckets = [a + b for a, b in zip(metrics.buckets, other.buckets)]
+
+    def items(self):
+        """
+        :return: ((service name, method, endpoint pattern), EndpointMetrics) pairs, sorted
+        """
+        with self._lock:
+            return sorted(self._endpoints.items())
+
+    def summary(self):
+        """
+        :return: Human readable table of all endpoints, slowest total first, followed by per-service totals
+        """
+        items = self.items()
+        width = max([12] + [len(service) for (service, method, endpoint), metrics in items])
+        lines = ['{:<{}} {:<6} {:>8} {:>6} {:>7} {:>6} {:>10} {:>9} {:>7} {:>7}  {}'.format(
+            'Service', width, 'Method', 'Requests', 'Errors', 'Retries', 'Cached', 'Bytes', 'Seconds', 'p50', 'p95', 'Endpoint')]
+        for (service, method, endpoint), metrics in sorted(items, key=lambda item: -item[1].time):
+            lines.append('{:<{}} {:<6} {:>8} {:>6} {:>7} {:>6} {:>10} {:>9.2f} {:>7} {:>7}  {}'.format(
+                service, width, method, metrics.requests, metrics.errors, metrics.retries, metrics.cached, metrics.bytes,
+                metrics.time, _format_bound(metrics.quantile(0.5)), _format_bound(metrics.quantile(0.95)), endpoint))
+        totals = dict()
+        for (service, method, endpoint), metrics in items:
+            total = totals.setdefault(service, [0, 0, 0.0])
+            total[0] += metrics.requests
+            total[1] += metrics.bytes
+            total[2] += metrics.time
+        for service, (requests, size, time) in sorted(totals.items()):
+            lines.append('{}: {} requests, {} bytes, {:.2f}s spent waiting for responses'.format(service, requests, size, time))
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return json.dumps([dict(service=service, method=method, endpoint=endpoint, **metrics.as_dict())
+                           for (service, method, endpoint), metrics in self.items()], indent=2) + '\n'
+
+    def to_prometheus(self):
+        """
+        :return: All metrics in Prometheus' text exposition format
+        """
+        lines = []
+        counters = (('requests', 'Requests sent, including retries'),
+                    ('errors', 'Requests that failed'),
+                    ('retries', 'Failed requests that were retried'),
+                    ('cached', 'Requests answered from the response cache'),
+                    ('bytes', 'Bytes received'))
+        items = self.items()
+        for name, help in counters:
+            lines.append('# HELP atlassian_crawl_{}_total {}'.format(name, help))
+            lines.append('# TYPE atlassian_crawl_{}_total counter'.format(name))
+            for key, metrics in items:
+                lines.append('atlassian_crawl_{}_total{{{}}} {}'.format(name, _labels(*key), getattr(metrics, name)))
+        lines.append('# HELP atlassian_crawl_request_seconds Time until we had a response')
+        lines.append('# TYPE atlassian_crawl_request_seconds histogram')
+        for key, metrics in items:
+            labels = _labels(*key)
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in BUCKETS] + ['+Inf'], metrics.buckets):
+                cumulative += count
+                lines.append('atlassian_crawl_request_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+            lines.append('atlassian_crawl_request_seconds_sum{{{}}} {}'.format(labels, metrics.time))
+            lines.append('atlassian_crawl_request_seconds_count{{{}}} {}'.format(labels, cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, filename):
+        """
+        Write all metrics to filename: as JSON if it ends in .json, in Prometheus' text format otherwise.
+        """
+        with open(filename, 'w', encoding='utf-8') as fd:
+            fd.write(self.to_json() if filename.endswith('.json') else self.to_prometheus())
+
+
+class ServiceMetrics:
+    """Records requests of a single service into a CrawlMetrics"""
+
+    def __init__(self, metrics, service):
+        self.metrics = metrics
+        self.service = service
+
+    def record(self, method, endpoint, **kwargs):
+        """See CrawlMetrics.record()"""
+        self.metrics.record(self.service, method, endpoint, **kwargs)
+
+
+def _labels(service, method, endpoint):
+    return 'service="{}",method="{}",endpoint="{}"'.format(*(_escape(value) for value in (service, method, endpoint)))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    if bound is None:
+        return '-'
+    if bound == float('inf'):
+        return '>{}'.format(BUCKETS[-1])
+    return '<{}'.format(bound)
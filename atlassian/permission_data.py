@@ -6,24 +6,156 @@
 # TODO: Jira issue visibility?
 # TODO: Stash!!
 
+from threading import Lock
+
+
+class PrincipalTable:
+    """
+    Interns user, group and permission names as well as sets of assignees.
+    The same names show up in thousands of projects, and every API response brings its own copy of them.
+    Passing each name through this table makes all permission entries share a single string object per name.
+    Likewise, many projects grant a permission to exactly the same users or groups;
+    those entries share a single frozenset once compacted.
+    """
+
+    def __init__(self):
+        self._names = dict()
+        self._sets = dict()
+        self._sorted = dict()
+        """Sorted tuples of names by frozenset, see sorted_names()"""
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def intern(self, name):
+        """
+        :return: The canonical string object for name
+        """
+        try:
+            return self._names[name]
+        except KeyError:
+            with self._lock:
+                return self._names.setdefault(name, name)
+
+    def intern_set(self, names):
+        """
+        :return: The canonical frozenset containing exactly names
+        """
+        names = frozenset(names)
+        try:
+            return self._sets[names]
+        except KeyError:
+            with self._lock:
+                return self._sets.setdefault(names, names)
+
+    def sorted_names(self, names):
+        """
+        :return: A sorted tuple of names. Sorted once per frozenset: as assignee sets are interned and shared
+                 by many entries, see intern_set(), most of them never need sorting again.
+        """
+        if not isinstance(names, frozenset):
+            return tuple(sorted(names))
+        try:
+            return self._sorted[names]
+        except KeyError:
+            with self._lock:
+                return self._sorted.setdefault(names, tuple(sorted(names)))
+
+
+principals = PrincipalTable()
+"""The principal table shared by all permission entries"""
+
+_EMPTY = frozenset()
+"""Shared placeholder for entries without users or groups, so we don't allocate an empty set for each of those"""
+
 
 class PermissionDict(dict):
     """
     Represents all permissions present that exist on a specific level,
     e.g. all project-level permissions for a specific Jira project
     or all page-level permissions for a protected Confluence page.
+
+    Keeps a version counter that increases whenever permissions are added or replaced,
+    so sorted views of it are cached until it actually changes, see sorted_items().
     """
+    __slots__ = ('_version', '_sorted')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._version = 0
+        self._sorted = None
+        """(version, sorted items) as of the last call to sorted_items()"""
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    # dict's own implementations of these don't go through __setitem__ or __delitem__
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._changed()
+        return result
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self._changed()
+        return result
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    @property
+    def version(self):
+        """A counter increased on every change to this PermissionDict"""
+        return self._version
+
+    def _changed(self):
+        self._version = self.version + 1
+
+    def sorted_items(self):
+        """
+        :return: A tuple of all (permission name, PermissionEntry) pairs, sorted by name.
+                 Cached until this PermissionDict changes.
+        """
+        version = self.version
+        cached = self._sorted
+        if cached is None or cached[0] != version:
+            cached = self._sorted = (version, tuple(sorted(self.items(), key=lambda t: t[0])))
+        return cached[1]
 
     def __str__(self):
-        result = ""
+        return "".join(self.iter_text())
+
+    def iter_text(self):
+        """Yield our plain text representation piece by piece: one line per permission, sorted by name"""
         first = True
-        for permission_key in sorted(self.keys()):
+        for permission_key, entry in self.sorted_items():
             if first:
                 first = False
             else:
-                result += "\n"
-            result += str(self[permission_key])
-        return result
+                yield "\n"
+            yield str(entry)
 
     def add_permission(self, permission, users=[], groups=[]):
         """
@@ -36,9 +168,18 @@ class PermissionDict(dict):
 
         if permission.name in self:
             self[permission.name].merge(permission)
+            self._changed()
         else:
             self[permission.name] = permission
 
+    def compact(self):
+        """
+        Let all entries share their assignee sets with identical entries elsewhere.
+        Call this once this PermissionDict is complete.
+        """
+        for entry in self.values():
+            entry.compact()
+
     def flatten(self):
         """
         A flat representation of this permission entry in first normal form,
@@ -57,8 +198,8 @@ class PermissionDict(dict):
             ['VIEWSPACE', 'User, 'Bob'],
         ]
         """
-        for permission_name in sorted(self.keys()):
-            yield from self[permission_name].flatten()
+        for permission_name, entry in self.sorted_items():
+            yield from entry.flatten()
 
 
 class PermissionEntry:
@@ -66,16 +207,28 @@ class PermissionEntry:
     Represents a single permission no matter on which level, e.g. browse privileges to a Jira project,
     or writing privileges to a protected Confluence page.
     Knows all users and groups who have this specific permission.
+
+    Names are interned in the shared principal table. Treat users and groups as read-only;
+    use additional() or merge() to extend them.
     """
+    __slots__ = ('name', 'users', 'groups')
 
     def __init__(self, name, users=None, groups=None):
-        self.name = name
+        self.name = principals.intern(name)
         """The name of this privilege. Note: For Jira, these are roles."""
 
-        self.users = set()
-        self.groups = set()
+        self.users = _EMPTY
+        self.groups = _EMPTY
         self.additional(users, groups)
 
+    def __setstate__(self, state):
+        # Pickles of older versions carry a plain __dict__, newer ones (None, slots)
+        if isinstance(state, tuple):
+            state = state[1]
+        self.name = state['name']
+        self.users = state['users'] or _EMPTY
+        self.groups = state['groups'] or _EMPTY
+
     def __str__(self):
         prefix = self.name + ": "
         #prefix = "" # we're really only using this to print who PermissionDicts and this doubles the name. TODO: find better solution
@@ -110,21 +263,38 @@ class PermissionEntry:
         ('VIEWSPACE', 'User', 'Alice'),
         ('VIEWSPACE', 'User, 'Bob')
         """
-        for group in sorted(self.groups):
+        for group in principals.sorted_names(self.groups):
             yield (str(self.name), 'Group', str(group))
-        for user in sorted(self.users):
+        for user in principals.sorted_names(self.users):
             yield (str(self.name), 'User', str(user))
 
     def additional(self, users=None, groups=None):
         """Extend this privilege to the specified users and groups"""
         if users:
-            if not isinstance(users, set):
-                users = {users}
-            self.users = self.users | users
+            self.users = self._extend(self.users, users)
         if groups:
-            if not isinstance(groups, set):
-                groups = {groups}
-            self.groups = self.groups | groups
+            self.groups = self._extend(self.groups, groups)
+
+    @staticmethod
+    def _extend(assignees, new):
+        """
+        Add new (a name or a set of names) to the set assignees, in place unless assignees is shared.
+        :return: the extended set
+        """
+        if isinstance(assignees, frozenset):  # shared, copy on write
+            assignees = set(assignees)
+        if isinstance(new, (set, frozenset)):
+            assignees.update(principals.intern(name) for name in new)
+        else:
+            assignees.add(principals.intern(new))
+        return assignees
+
+    def compact(self):
+        """
+        Replace our assignee sets by shared, immutable ones. Later extensions will copy them first.
+        """
+        self.users = principals.intern_set(self.users) if self.users else _EMPTY
+        self.groups = principals.intern_set(self.groups) if self.groups else _EMPTY
 
     def merge(self, other_permission_entry):
         if other_permission_entry.name != self.name:
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+
+from .permission_data import principals
+
+
+class PermissionIndex:
+    """
+    Reverse index of a MyLittleAtlassianWorld, mapping users and groups to everything they were granted,
+    so "what can alice access?" doesn't mean scanning every project of every service.
+    Built in a single pass over the world, then kept up to date as projects' permissions are reloaded:
+    the index registers itself as listener on all services, see Service.add_listener().
+    If a service's list of projects changes, call build() again to drop projects that are gone.
+    """
+
+    USER = 'User'
+    GROUP = 'Group'
+
+    def __init__(self, world):
+        self.world = world
+        self._grants = {self.USER: dict(), self.GROUP: dict()}
+        """Sets of (service key, project key, permission) by principal name, by principal type"""
+        self._projects = dict()
+        """(type, name, permission) tuples indexed for each (service key, project key), so we can drop them again"""
+        self._service_keys = dict()
+        """Service keys by id() of the service object, to tell which service notified us"""
+        self._lock = Lock()
+        self.build()
+
+    def build(self):
+        """
+        (Re-)index all projects of our world whose permissions are loaded and follow all its services.
+        Projects whose permissions aren't loaded yet are indexed as soon as they are.
+        """
+        with self._lock:
+            for grants in self._grants.values():
+                grants.clear()
+            self._projects.clear()
+            for service_key, service in self.world.services.items():
+                if id(service) not in self._service_keys:
+                    service.add_listener(self)
+                self._service_keys[id(service)] = service_key
+                for project_key, project in (service._projects or dict()).items():  # never trigger a crawl
+                    if project._permissions is not None:
+                        self._add(service_key, project_key, project._permissions)
+
+    def close(self):
+        """
+        Stop following our world's services.
+        """
+        for service in self.world.services.values():
+            if id(service) in self._service_keys:
+                service.remove_listener(self)
+        self._service_keys.clear()
+
+    def __call__(self, service, project):
+        """Listener callback: re-index a project whose permissions have just been loaded"""
+        service_key = self._service_keys.get(id(service))
+        if service_key is None:
+            return
+        with self._lock:
+            self._remove(service_key, project.key)
+            self._add(service_key, project.key, project.permissions)
+
+    def user(self, name):
+        """
+        :return: A sorted list of (service key, project key, permission) granted directly to user name
+        """
+        return self._lookup(self.USER, name)
+
+    def group(self, name):
+        """
+        :return: A sorted list of (service key, project key, permission) granted to group name
+        """
+        return self._lookup(self.GROUP, name)
+
+    @property
+    def users(self):
+        """:return: A sorted list of all users holding any permission"""
+        with self._lock:
+            return sorted(self._grants[self.USER].keys())
+
+    @property
+    def groups(self):
+        """:return: A sorted list of all groups holding any permission"""
+        with self._lock:
+            return sorted(self._grants[self.GROUP].keys())
+
+    def _lookup(self, type, name):
+        with self._lock:
+            return sorted(self._grants[type].get(name, ()))
+
+    def _add(self, service_key, project_key, permissions):
+        """Index all grants of a project. Call with self._lock held."""
+        service_key = principals.intern(service_key)
+        project_key = principals.intern(project_key)
+        indexed = []
+        for entry in permissions.values():
+            grant = (service_key, project_key, entry.name)  # shared by all principals holding this permission
+            for type, names in ((self.USER, entry.users), (self.GROUP, entry.groups)):
+                for name in names:
+                    self._grants[type].setdefault(name, set()).add(grant)
+                    indexed.append((type, name, entry.name))
+        if indexed:
+            self._projects[(service_key, project_key)] = indexed
+
+    def _remove(self, service_key, project_key):
+        """Drop all grants of a project from the index. Call with self._lock held."""
+        for type, name, permission in self._projects.pop((service_key, project_key), ()):
+            grants = self._grants[type].get(name)
+            if grants is None:
+                continue
+            grants.discard((service_key, project_key, permission))
+            if not grants:
+                del self._grants[type][name]
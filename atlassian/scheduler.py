@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from email.utils import parsedate_to_datetime
+import logging
+import random
+from threading import Condition, Lock
+from time import monotonic, perf_counter, sleep, time
+
+
+l = logging.getLogger(__name__)
+
+
+class RetryableError(Exception):
+    """
+    Raised by request functions passed to RequestScheduler.execute() if a request failed
+    in a way that is worth retrying, e.g. a 429 or 503 response or a dropped connection.
+    """
+    def __init__(self, error, retry_after=None, overload=False):
+        """
+        :param error: the exception to raise if we give up retrying
+        :param retry_after: seconds the server asked us to wait, if any
+        :param overload: whether the server told us it's overloaded; we'll lower our concurrency limit
+        """
+        super().__init__(str(error))
+        self.error = error
+        self.retry_after = retry_after
+        self.overload = overload
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        :param value: a Retry-After header, either seconds or an HTTP date
+        :return: seconds to wait, or None if value is missing or unparsable
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket:
+    """
+    Limits the request rate to rate requests per second on average, allowing bursts of up to burst requests.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Block until we may send another request."""
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+class AdaptiveLimit:
+    """
+    Limits the number of concurrent requests to a host, adapting the limit to how the host copes:
+    the limit grows slowly while latency stays close to the best latency we've seen,
+    and shrinks quickly once latency rises or the host reports overload (additive increase, multiplicative decrease).
+    """
+    def __init__(self, maximum, minimum=1, tolerance=2.0, decrease=0.75):
+        """
+        :param maximum: the limit never grows beyond this
+        :param tolerance: back off if latency exceeds this multiple of our baseline latency
+        :param decrease: factor to multiply our limit with when backing off
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.decrease = decrease
+
+        self.limit = float(maximum)
+        self._active = 0
+        self._baseline = None
+        """Lowest latency seen recently. Slowly drifts upwards so it can follow permanent changes."""
+        self._condition = Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= int(self.limit):
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, latency=None, overload=False):
+        with self._condition:
+            self._active -= 1
+            if overload:
+                self._back_off()
+            elif latency is not None:
+                if self._baseline is None or latency < self._baseline:
+                    self._baseline = latency
+                else:
+                    self._baseline *= 1.01
+                if latency > self._baseline * self.tolerance:
+                    self._back_off()
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _back_off(self):
+        old = int(self.limit)
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        if int(self.limit) < old:
+            l.info('Lowering concurrency limit to %d', int(self.limit))
+
+
+class RequestScheduler:
+    """
+    Sends requests on behalf of all our service clients, so every host is treated considerately:
+      - a token bucket per host limits the request rate
+      - an adaptive limit per host caps concurrent requests, backing off when latency rises
+      - failed requests are retried with exponential backoff and jitter, honoring Retry-After
+    A single scheduler should be shared by all clients of a run, so limits apply per host, not per client.
+    """
+
+    def __init__(self, rate=None, burst=None, max_retries=5, backoff=0.5, max_backoff=60.0, max_concurrency=None):
+        """
+        :param rate: maximum average requests per second per host. None means no limit.
+        :param burst: maximum burst of requests per host above rate
+        :param max_retries: how often to retry a failed request before giving up
+        :param backoff: base delay in seconds before the first retry; doubles with each further retry
+        :param max_backoff: maximum delay between retries, unless the server asks for a longer one
+        :param max_concurrency: maximum concurrent requests per host, adapted to the host's latency.
+                                None means no limit.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+
+        self._buckets = dict()
+        self._limits = dict()
+        self._lock = Lock()
+
+        self.retries = 0
+        """Number of retried requests"""
+
+    def execute(self, host, function):
+        """
+        Call function, which sends a single request to host, respecting our limits and retrying if it
+        raises RetryableError.
+        :return: whatever function returns
+        """
+        bucket, limit = self._limits_for(host)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            if limit is not None:
+                limit.acquire()
+            start = perf_counter()
+            try:
+                result = function()
+            except RetryableError as e:
+                if limit is not None:
+                    limit.release(overload=e.overload)
+                if attempt >= self.max_retries:
+                    raise e.error
+                delay = self.delay(attempt, e.retry_after)
+                l.warning('%s; retrying in %.1fs (attempt %d of %d)', e, delay, attempt + 1, self.max_retries)
+                with self._lock:
+                    self.retries += 1
+                sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                if limit is not None:
+                    limit.release()
+                raise
+            if limit is not None:
+                limit.release(perf_counter() - start)
+            return result
+
+    def delay(self, attempt, retry_after=None):
+        """
+        :return: Seconds to wait before retry number attempt (counting from 0): exponential backoff with full jitter,
+                 but never less than the server asked us to wait.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _limits_for(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst) if self.rate else None
+                self._limits[host] = AdaptiveLimit(self.max_concurrency) if self.max_concurrency else None
+            return self._buckets[host], self._limits[host]
@@ -3,10 +3,15 @@
 
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
+from fnmatch import fnmatchcase
+from hashlib import sha1
+import json
 import logging
-from deepdiff import DeepDiff
 
 from .permission_data import *
+from .crawler import Crawler
+from .diff import PermissionDiff
+from .permission_index import PermissionIndex
 
 
 class MyLittleAtlassianWorld():
@@ -14,16 +19,22 @@ class MyLittleAtlassianWorld():
         self.services = services
         """List of all Configured Atlassian services"""
 
+        self._permission_index = None
+
     def __str__(self):
-        result = ""
+        return "".join(self.iter_text())
+
+    def iter_text(self):
+        """
+        Yield our plain text representation piece by piece, so it can be written out without building it in memory.
+        """
         first = True
         for service_key in sorted(self.services.keys()):
             if first:
                 first = False
             else:
-                result += "\n\n"
-            result += str(self.services[service_key])
-        return result
+                yield "\n\n"
+            yield from self.services[service_key].iter_text()
 
     @property
     def permissions(self):
@@ -36,9 +47,91 @@ class MyLittleAtlassianWorld():
             result[service_key] = self.services[service_key].permissions
         return result
 
-    def refresh(self):
-        for service in self.services.values():
-            service.refresh_permissions()
+    @property
+    def carried_over_projects(self):
+        """
+        :return: (service key, project key) of all projects whose permissions an incremental crawl carried over
+                 from an older crawl, see Service.carry_over_permissions()
+        :rtype: list
+        """
+        return [(service_key, project_key)
+                for service_key in sorted(self.services.keys())
+                for project_key, project in sorted((self.services[service_key]._projects or dict()).items())
+                if project.carried_over]
+
+    @property
+    def permission_index(self):
+        """
+        Reverse index of all permissions by user and group, built on first access
+        and kept up to date as projects are reloaded afterwards.
+        :rtype: PermissionIndex
+        """
+        if self._permission_index is None:
+            self._permission_index = PermissionIndex(self)
+        return self._permission_index
+
+    def restrict(self, service_keys=None, project_patterns=None):
+        """
+        Limit this world to some services and projects, e.g. for spot checks.
+        Services and projects outside the selection are dropped if already loaded, and won't be loaded in the first place
+        otherwise: see Service.wants_project().
+        :param service_keys: keys of the services to keep, case insensitive. A kind of service like Jira
+                             keeps all services of that kind. None keeps all services.
+        :param project_patterns: glob patterns of the project keys to keep, case insensitive. None keeps all projects.
+        """
+        if service_keys is not None:
+            wanted = {key.lower() for key in service_keys}
+            self.services = {key: service for key, service in self.services.items()
+                             if key.lower() in wanted or service.__class__.name.lower() in wanted}
+        if project_patterns is not None:
+            for service in self.services.values():
+                service.project_patterns = list(project_patterns)
+                if service._projects is not None:
+                    service._projects = {key: project for key, project in service._projects.items()
+                                         if service.wants_project(key)}
+        if self._permission_index is not None:
+            self._permission_index.build()
+
+    def merge(self, other):
+        """
+        Take over the projects and permissions of all services of other, e.g. services crawled separately.
+        They replace the projects of our services with the same keys; services we don't have are added.
+        Our services keep their configuration and sessions.
+        """
+        services = dict(self.services)
+        for service_key, service in other.services.items():
+            ours = services.setdefault(service_key, service)
+            if ours is not service:
+                ours._projects = service._projects
+                for project in (ours._projects or dict()).values():
+                    project.service = ours
+        self.services = services
+        if self._permission_index is not None:
+            self._permission_index.build()
+
+    def refresh(self, workers=1, host_limit=None, previous=None):
+        """
+        Reload all permissions of all services via network.
+        :param workers: number of concurrent permission loads per service. 1 means crawl serially.
+        :param host_limit: maximum number of concurrent permission loads per host, None for no limit
+        :param previous: an older MyLittleAtlassianWorld. If set, crawl incrementally:
+                         only load permissions of projects that are new or changed since then
+                         and carry over all others.
+        """
+        if workers <= 1:
+            for service_key, service in self.services.items():
+                service.refresh_permissions(self.previous_service(previous, service_key))
+        else:
+            Crawler(workers, host_limit).crawl(self, previous)
+
+    @staticmethod
+    def previous_service(previous, service_key):
+        """
+        :return: The service with the specified key in the previous world, None if there's no such world or service
+        """
+        if previous is None:
+            return None
+        return previous.services.get(service_key)
 
     @property
     def flat_permissions(self):
@@ -67,20 +160,13 @@ class MyLittleAtlassianWorld():
         for service in self.services.values():
             service.logout()
 
-    def _exclude_for_diff(self):
-        for service_name, service in self.services.items():
-            for item in service.exclude_for_diff():
-                yield ".services['" + service_name + "']" + item
-
     def diff(self, other):
         """
-        Use deepdiff to create a dict of differences between myself and another MyLittleAtlassianWorld object.
-        :rtype: DeepDiff
+        Compare myself to another MyLittleAtlassianWorld object.
+        :return: The changes from me to other
+        :rtype: PermissionDiff
         """
-        exclude = []
-        for item in self._exclude_for_diff():
-            exclude.append("root" + item)
-        return DeepDiff(self, other, exclude_paths=exclude)
+        return PermissionDiff(self, other)
 
 
 class Service(metaclass=ABCMeta):
@@ -90,6 +176,9 @@ class Service(metaclass=ABCMeta):
     There's normally no need to call those manually.
     You'll probably just need to access the projects and permissions properties.
     """
+    max_concurrency = None
+    """Maximum number of concurrent API requests this service's API supports. None means no limit."""
+
     def __init__(self, url, name=None, version=None):
         """
         :param url: URL of service
@@ -121,13 +210,31 @@ class Service(metaclass=ABCMeta):
         self._data = {}
         """Raw API data"""
 
+        self.client_options = {}
+        """Keyword arguments for the HTTPClient this service creates on login, e.g. pool_size"""
+
+        self._listeners = []
+        """Callbacks to notify whenever a project's permissions have been loaded"""
+
+        self.project_patterns = None
+        """Glob patterns of the keys of the projects to load, e.g. ['DEMO', 'OPS-*']. None loads all projects."""
+
+        self._sorted_project_keys = None
+        """(projects dict, number of projects, sorted keys) as of the last call to sorted_project_keys()"""
+
+        self._permissions = None
+        """(sorted keys, permission data of each project, result) as of the last access to permissions"""
+
     def __str__(self):
-        result = self.name
-        result += ":\n"
-        result += ("-" * (len(self.name)+1) ) + "\n"
-        for project_key in sorted(self.projects.keys()):
-            result += str(self.projects[project_key]) + "\n"
-        return result
+        return "".join(self.iter_text())
+
+    def iter_text(self):
+        """Yield our plain text representation piece by piece, see MyLittleAtlassianWorld.iter_text()"""
+        yield self.name + ":\n"
+        yield ("-" * (len(self.name)+1) ) + "\n"
+        for project_key in self.sorted_project_keys():
+            yield from self.projects[project_key].iter_text()
+            yield "\n"
 
     def assert_logged_in(self):
         if not self._logged_in:
@@ -146,7 +253,7 @@ class Service(metaclass=ABCMeta):
     @property
     def projects(self):
         """dict of all projects in this service"""
-        if not self._projects:
+        if self._projects is None:
             self.refresh_projects()
         return self._projects
 
@@ -154,7 +261,28 @@ class Service(metaclass=ABCMeta):
         self.assert_logged_in()
         self._projects = dict()
         for project in self.load_projects():
-            self._projects[project.key] = project
+            if self.wants_project(project.key):
+                self._projects[project.key] = project
+
+    def sorted_project_keys(self):
+        """
+        :return: A tuple of the keys of all our projects, sorted. Cached until the list of projects changes.
+        """
+        projects = self.projects
+        cached = self._sorted_project_keys
+        if cached is None or cached[0] is not projects or cached[1] != len(projects):
+            cached = self._sorted_project_keys = (projects, len(projects), tuple(sorted(projects.keys())))
+        return cached[2]
+
+    def wants_project(self, key):
+        """
+        Whether the project with this key matches our project_patterns, i.e. whether to load it.
+        Services should check this in load_projects() to skip loading anything below unwanted projects.
+        """
+        if self.project_patterns is None:
+            return True
+        key = key.lower()
+        return any(fnmatchcase(key, pattern.lower()) for pattern in self.project_patterns)
 
     @abstractmethod
     def load_projects(self):
@@ -174,12 +302,16 @@ class Service(metaclass=ABCMeta):
                     'KEY1': [permission1 <PermissionEntry>, permission2 <PermissionEntry>],
                     'KEY2': [permission1 <PermissionEntry>, permission2 <PermissionEntry>]
                 }
+                Cached until any project or the list of projects changes; don't modify it.
         :rtype: OrderedDict
         """
-        result = OrderedDict()
-        for project_key in sorted(self.projects.keys()):
-            result[project_key] = self.projects[project_key].permission_data()
-        return result
+        keys = self.sorted_project_keys()
+        data = [self.projects[project_key].permission_data() for project_key in keys]
+        cached = self._permissions
+        if (cached is None or cached[0] is not keys or
+                any(new is not old for new, old in zip(data, cached[1]))):
+            cached = self._permissions = (keys, data, OrderedDict(zip(keys, data)))
+        return cached[2]
 
     @property
     def flat_permissions(self):
@@ -198,20 +330,87 @@ class Service(metaclass=ABCMeta):
         Example:
         ['DEMO', 'Developers', 'User',  'Alice']
         """
-        for project_key in sorted(self.projects.keys()):
+        for project_key in self.sorted_project_keys():
             for permission_name, type, assignee in self.projects[project_key].permissions.flatten():
                 yield project_key, permission_name, type, assignee
 
-    def refresh_permissions(self):
+    def refresh_permissions(self, previous=None):
         """
         Reloads all permissions via the API.
         Afterwards, accessing the permissions property should get you up to date information.
+        :param previous: an older copy of this service. If set, reload the list of projects and
+                         only load permissions for projects that are new or changed since then.
         :rtype: None
         """
         self.assert_logged_in()
-        for project in self.projects.values():
+        if previous is None:
+            projects = self.projects.values()
+        else:
+            self.refresh_projects()
+            projects = self.carry_over_permissions(previous)
+        for project in projects:
             project.refresh_permissions()
+        self.finish_crawl()
+
+    def carry_over_permissions(self, previous):
+        """
+        Reuse the permissions of all projects whose change marker did not move since previous was crawled.
+        Carried over projects are marked as such, as their permissions may have changed without touching their marker.
+        :param previous: an older copy of this service
+        :return: A list of all projects that still need their permissions loaded
+        """
+        stale = []
+        previous_projects = previous.projects
+        for key, project in self.projects.items():
+            old = previous_projects.get(key)
+            marker = project.change_marker
+            if marker is not None and old is not None and old._permissions is not None and old.change_marker == marker:
+                project._permissions = old._permissions
+                project.carried_over = True
+            else:
+                stale.append(project)
+        carried = len(self.projects) - len(stale)
+        self.l.info("Incremental crawl: carrying over %d projects, reloading %d.", carried, len(stale))
+        if carried:
+            self.l.warning("%s: carried over the permissions of %d unchanged projects without checking them. "
+                           "Changes to their permissions alone are only picked up by a full crawl.", self.name, carried)
+        return stale
+
+    def change_marker(self, project):
+        """
+        A value that changes whenever a project's listing data changes, e.g. because it was renamed,
+        moved or updated. Used to decide which projects to reload in incremental crawls.
+        Services may override this if their API offers a more specific marker like an update timestamp,
+        or return None for projects that should always be reloaded.
+        :param project: Project
+        :rtype: str
+        """
+        data = json.dumps(project.data, sort_keys=True, default=str)
+        return sha1(data.encode('utf-8')).hexdigest()
+
+    def add_listener(self, callback):
+        """
+        Register a callback to be called as callback(service, project) whenever a project's permissions
+        have been loaded. Note this may happen on crawler worker threads.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
 
+    def project_refreshed(self, project):
+        """
+        Notify all listeners that project's permissions have been loaded.
+        """
+        for callback in self._listeners:
+            callback(self, project)
+
+    def finish_crawl(self):
+        """
+        Called after all permissions of this service have been refreshed.
+        Services may override this to clean up or report crawl statistics.
+        """
+        pass
 
     @abstractmethod
     def load_permissions_for_project(self, project_key):
@@ -227,6 +426,15 @@ class Service(metaclass=ABCMeta):
         """
         pass
 
+    def load_group_members(self, group):
+        """
+        Freshly load the names of all users in a group via network.
+        Services whose API can't list group members return None.
+        :param group: group name
+        :rtype: list
+        """
+        return None
+
     @abstractmethod
     def logout(self):
         """
@@ -234,12 +442,6 @@ class Service(metaclass=ABCMeta):
         """
         pass
 
-    def exclude_for_diff(self):
-        """
-        :return: A list of member that should not be considered for
-        """
-        return [".l", "._api", "._data"]  # TODO: validate names (ensure there's some kind of sensible error if someone changes those but doesn't change them here)
-
     def __del__(self):
         #self.logout()
         pass
@@ -260,38 +462,73 @@ class Project:
         A PermissionDict() mapping permission names to permission objects.
         """
 
+        self._change_marker = None
+        """Cached result of Service.change_marker() for this project"""
+
+        self.carried_over = False
+        """Whether an incremental crawl took our permissions from an older crawl instead of loading them"""
+
+        self._permission_data = None
+        """(permissions, their version, result) as of the last call to permission_data()"""
+
     def __str__(self):
-        result = self.key + ": "
-        prefixlen = len(result)
-        perms = str(self.permissions)
-        result += str(perms).replace("\n", "\n" + " " * prefixlen)
-        return result
+        return "".join(self.iter_text())
+
+    def iter_text(self):
+        """
+        Yield our plain text representation piece by piece, see MyLittleAtlassianWorld.iter_text().
+        Permissions are indented to line up with the first one, following our key.
+        Carried over projects are marked, see Service.carry_over_permissions().
+        """
+        prefix = self.key + (" (carried over)" if self.carried_over else "") + ": "
+        yield prefix
+        newline = "\n" + " " * len(prefix)
+        for chunk in self.permissions.iter_text():
+            yield chunk.replace("\n", newline)
 
     @property
     def key(self):
         return self.data.get('key', None)
 
+    @property
+    def change_marker(self):
+        """
+        :return: A value that changes whenever this project changes. See Service.change_marker().
+        """
+        if self._change_marker is None:
+            self._change_marker = self.service.change_marker(self)
+        return self._change_marker
+
     @property
     def permissions(self):
         """
         :return: A dictionary of all permissions for this project
         :rtype: PermissionDict
         """
-        if not self._permissions:
+        if self._permissions is None:
             self.refresh_permissions()
         return self._permissions
 
     def permission_data(self):
         """
         :return: An alphabetically ordered dictionary of permission entries. Note this is not a PermissionDict anymore.
+                 Cached until our permissions change, see PermissionDict.version; don't modify it.
         """
-        return OrderedDict(sorted(self.permissions.items(), key=lambda t: t[0]))
+        permissions = self.permissions
+        cached = self._permission_data
+        if cached is None or cached[0] is not permissions or cached[1] != permissions.version:
+            cached = self._permission_data = (permissions, permissions.version, OrderedDict(permissions.sorted_items()))
+        return cached[2]
 
     def refresh_permissions(self):
         """
+        Build a fresh PermissionDict and swap it in once it is complete,
+        so concurrent readers never see a half-loaded project.
         :rtype None
         """
-        self._permissions = PermissionDict()
-
+        permissions = PermissionDict()
         for permission in self.service.load_permissions_for_project(self.key):
-            self._permissions.add_permission(permission)
+            permissions.add_permission(permission)
+        permissions.compact()
+        self._permissions = permissions
+        self.service.project_refreshed(self)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compact, versioned snapshots of a MyLittleAtlassianWorld.
+
+A snapshot is a line-delimited JSON file, optionally gzip compressed.
+The first line is a header naming the format and its version.
+Every following line is one record:
+
+  ["s", id, "text"]                 defines interned string number id
+  ["service", key, class, url, name] starts a new service (all values are string ids)
+  ["project", key, marker, perms]   a project of the last service;
+                                    perms is a list of [permission, [user ids], [group ids]]
+                                    or null if the project's permissions were never loaded.
+                                    A trailing true marks projects carried over by an incremental crawl.
+
+Snapshots are written and read as a stream, one project at a time.
+Only permissions and change markers are stored, not the raw API data or any session state.
+"""
+
+import gzip
+import json
+import logging
+
+from .service_model import MyLittleAtlassianWorld, Project
+from .permission_data import PermissionDict, PermissionEntry
+from .confluence import Confluence
+from .jira import Jira
+from .stash import Stash
+
+
+l = logging.getLogger(__name__)
+
+FORMAT = 'atlassian-permissions-snapshot'
+VERSION = 1
+
+SERVICE_CLASSES = {cls.__name__: cls for cls in (Confluence, Jira, Stash)}
+"""Service classes we can restore, by class name"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class SnapshotError(Exception):
+    """Raised if a snapshot can't be read."""
+    pass
+
+
+def save(world, filename, compress=None):
+    """
+    Save world to a snapshot file.
+    :param compress: whether to gzip the snapshot. Default: compress if filename ends in .gz
+    """
+    if compress is None:
+        compress = filename.endswith('.gz')
+    if compress:
+        with gzip.open(filename, 'wt', encoding='utf-8') as stream:
+            dump(world, stream)
+    else:
+        with open(filename, 'w', encoding='utf-8') as stream:
+            dump(world, stream)
+
+
+def load(filename):
+    """
+    Load a MyLittleAtlassianWorld from a snapshot file.
+    Understands all snapshot versions as well as pickles written by older versions of this software.
+    :rtype: MyLittleAtlassianWorld
+    """
+    with open(filename, 'rb') as fd:
+        magic = fd.read(len(GZIP_MAGIC))
+    if magic == GZIP_MAGIC:
+        with gzip.open(filename, 'rt', encoding='utf-8') as stream:
+            return read(stream)
+
+    with open(filename, 'rb') as fd:
+        first_line = fd.readline()
+    if first_line.startswith(b'{'):
+        with open(filename, 'r', encoding='utf-8') as stream:
+            return read(stream)
+    return _load_pickle(filename)
+
+
+def dump(world, stream):
+    """
+    Write world as a snapshot to a text stream.
+    """
+    strings = dict()
+
+    def intern(text):
+        if text not in strings:
+            strings[text] = len(strings)
+            _write(stream, ["s", strings[text], text])
+        return strings[text]
+
+    _write(stream, {'format': FORMAT, 'version': VERSION})
+    for service_key in sorted(world.services.keys()):
+        service = world.services[service_key]
+        _write(stream, ["service", intern(service_key), intern(service.__class__.__name__),
+                        intern(service.url), intern(service.name)])
+        projects = service._projects or dict()
+        for project_key in sorted(projects.keys()):
+            project = projects[project_key]
+            permissions = None
+            if project._permissions is not None:
+                permissions = []
+                for name in sorted(project._permissions.keys()):
+                    entry = project._permissions[name]
+                    permissions.append([intern(name),
+                                        [intern(user) for user in sorted(entry.users)],
+                                        [intern(group) for group in sorted(entry.groups)]])
+            record = ["project", intern(project_key), project.change_marker, permissions]
+            if project.carried_over:
+                record.append(True)
+            _write(stream, record)
+
+
+def read(stream):
+    """
+    Read a snapshot from a text stream.
+    :rtype: MyLittleAtlassianWorld
+    """
+    try:
+        header = json.loads(stream.readline())
+    except ValueError as e:
+        raise SnapshotError('Not a snapshot: {}'.format(e))
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise SnapshotError('Not a snapshot')
+    version = header.get('version')
+    if version not in READERS:
+        raise SnapshotError('Unsupported snapshot version {}. Please upgrade this software.'.format(version))
+    return READERS[version](stream)
+
+
+def _read_v1(stream):
+    strings = []
+    services = dict()
+    service = None
+    for line in stream:
+        record = json.loads(line)
+        kind = record[0]
+        if kind == "s":
+            strings.append(record[2])
+        elif kind == "service":
+            key, class_name, url, name = (strings[i] for i in record[1:5])
+            if class_name not in SERVICE_CLASSES:
+                raise SnapshotError('Unknown service type {}'.format(class_name))
+            service = SERVICE_CLASSES[class_name](url, name=name)
+            service._projects = dict()
+            services[key] = service
+        elif kind == "project":
+            key_id, marker, permissions = record[1:4]
+            project = Project(service, {'key': strings[key_id]})
+            project._change_marker = marker
+            project.carried_over = len(record) > 4 and bool(record[4])
+            if permissions is not None:
+                project._permissions = PermissionDict()
+                for name_id, user_ids, group_ids in permissions:
+                    project._permissions.add_permission(
+                        PermissionEntry(strings[name_id],
+                                        {strings[i] for i in user_ids},
+                                        {strings[i] for i in group_ids}))
+                project._permissions.compact()
+            service._projects[project.key] = project
+        else:
+            l.warning('Ignoring unknown snapshot record type %s', kind)
+    return MyLittleAtlassianWorld(services)
+
+
+READERS = {1: _read_v1}
+"""Snapshot readers by format version"""
+
+
+def _write(stream, record):
+    stream.write(json.dumps(record, separators=(',', ':')))
+    stream.write('\n')
+
+
+def _load_pickle(filename):
+    """
+    Load a world pickled by versions of this software before snapshots existed.
+    The pickled objects carry the attributes of the version that wrote them, so we only take over their data
+    and build a fresh world from it, as read() does from snapshot records.
+    """
+    try:
+        import dill
+    except ImportError:
+        raise SnapshotError('{} is a legacy pickle; please install dill to read it.'.format(filename))
+
+    class LegacyUnpickler(dill.Unpickler):
+        def find_class(self, module, name):
+            if module == PermissionDict.__module__ and name == PermissionDict.__name__:
+                return _LegacyPermissionDict  # just hold the entries; we copy them into fresh PermissionDicts
+            return super().find_class(module, name)
+
+    with open(filename, 'rb') as fd:
+        legacy = LegacyUnpickler(fd).load()
+    return _from_legacy(legacy)
+
+
+class _LegacyPermissionDict(dict):
+    """Stand-in for PermissionDicts unpickled from older versions, whatever attributes they were pickled with"""
+    pass
+
+
+def _from_legacy(legacy):
+    """
+    :param legacy: a MyLittleAtlassianWorld unpickled from an older version of this software
+    :rtype: MyLittleAtlassianWorld
+    """
+    services = dict()
+    for key, legacy_service in legacy.__dict__.get('services', dict()).items():
+        state = legacy_service.__dict__
+        class_name = legacy_service.__class__.__name__
+        if class_name not in SERVICE_CLASSES:
+            raise SnapshotError('Unknown service type {}'.format(class_name))
+        service = SERVICE_CLASSES[class_name](state['url'], name=state.get('name'))
+        service._projects = dict()
+        for project_key, legacy_project in (state.get('_projects') or dict()).items():
+            project_state = legacy_project.__dict__
+            project = Project(service, dict(project_state.get('data') or {'key': project_key}))
+            legacy_permissions = project_state.get('_permissions')
+            if legacy_permissions is not None:
+                project._permissions = PermissionDict()
+                for name, entry in legacy_permissions.items():
+                    project._permissions.add_permission(
+                        PermissionEntry(name, set(entry.users or ()), set(entry.groups or ())))
+                project._permissions.compact()
+            service._projects[project_key] = project
+        services[key] = service
+    return MyLittleAtlassianWorld(services)
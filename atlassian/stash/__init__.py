@@ -1,11 +1,13 @@
 from collections import defaultdict
+from fnmatch import fnmatchcase
 import logging
 from urllib.parse import urlsplit
 from urllib.parse import urljoin
+from urllib.parse import quote
 
 from ..service_model import Service, Project
 from ..permission_data import PermissionEntry
-from .. import HTTPClient
+from .. import HTTPClient, HTTPError
 
 
 l = logging.getLogger(__name__)
@@ -14,8 +16,29 @@ l = logging.getLogger(__name__)
 class Stash(Service):
     GLOBALKEY = 'STASH-GLOBAL'
     REPO_DELIM = ':'
+    PAGE_LIMIT = 1000
+    """Page size we ask for. Stash caps this at its configured maximum (page.max.* settings) anyway."""
     name = 'Stash'
 
+    PERMISSION_MODES = ('auto', 'bulk', 'classic')
+    """
+    How we load project and repository permissions:
+      - classic: list group and user permissions separately, i.e. at least two requests per project and repository
+      - bulk: use the permission search endpoint, listing users and groups in a single paged request.
+              Its results may include grants implied by others, e.g. project permissions showing up on repositories,
+              so they can differ from classic, which only lists direct grants.
+      - auto: use bulk where the server supports it, classic otherwise
+    """
+
+    def __init__(self, url, name=None, version=None, permission_mode='classic'):
+        super().__init__(url, name, version)
+        if permission_mode not in self.PERMISSION_MODES:
+            raise ValueError('Unknown Stash permission mode: {}'.format(permission_mode))
+        self.permission_mode = permission_mode
+
+        self._search_supported = None
+        """Whether this server has the permission search endpoint. None if we haven't tried yet."""
+
     @property
     def client(self):
         if 'client' not in self._data:
@@ -24,10 +47,12 @@ class Stash(Service):
 
     def login(self, user, password):
         super().login(user, password)
-        self._data['client'] = HTTPClient(self.url, user=user, password=password)
+        self._data['client'] = HTTPClient(self.url, user=user, password=password, **self.client_options)
 
     def logout(self):
-        pass  # TODO logout of stash
+        # TODO logout of stash
+        if 'client' in self._data:
+            self._data.pop('client').close()
 
     def load_projects(self):
         l.debug("Starting to fetch Stash projects.")
@@ -36,21 +61,47 @@ class Stash(Service):
             projectkey = proj['key']
             l.debug("Fetched Stash project " + projectkey)
             yield Project(self, proj)
+            if not self.wants_repos_of(projectkey):
+                continue
             for repo in self._get_pages('/rest/api/1.0/projects/{projectKey}/repos'.format(projectKey=projectkey)):
                 repo['key'] = '{}{}{}'.format(projectkey, self.REPO_DELIM, repo['slug'])
                 #del repo['cloneUrl']  # TODO: why did these two lines exist?
                 #del repo['links']['clone']
                 yield Project(self, repo) # TODO repo!=project
 
+    def wants_project(self, key):
+        """
+        Repositories are wanted if they match one of our project patterns themselves,
+        e.g. DEMO:website or DEMO:web*, or if their project does.
+        """
+        if super().wants_project(key):
+            return True
+        return self.REPO_DELIM in key and super().wants_project(key.split(self.REPO_DELIM, 1)[0])
+
+    def wants_repos_of(self, project_key):
+        """
+        Whether any repository of this project may match our project patterns, i.e. whether to list its repositories.
+        """
+        if self.project_patterns is None or self.wants_project(project_key):
+            return True
+        return any(self.REPO_DELIM in pattern and
+                   fnmatchcase(project_key.lower(), pattern.split(self.REPO_DELIM, 1)[0].lower())
+                   for pattern in self.project_patterns)
+
+    def change_marker(self, project):
+        if project.key == self.GLOBALKEY:
+            return None  # there's no listing data telling us whether global permissions changed
+        return super().change_marker(project)
+
     def load_permissions_for_project(self, project_key):
         l.debug("Fetching stash permissions for " + project_key)
         # global permissions
-        if project_key is self.GLOBALKEY:
-            result = self._get_permissions('/rest/api/1.0/admin/permissions/{}')
+        if project_key == self.GLOBALKEY:
+            result = self._get_classic_permissions('/rest/api/1.0/admin/permissions/{}')
             return result
         elif self.REPO_DELIM in project_key:
             # repo permissions
-            project_key, repo_slug = project_key.split(':')
+            project_key, repo_slug = project_key.split(self.REPO_DELIM, 1)
             result = self._get_permissions('/rest/api/1.0/projects/{projectKey}/repos/{repositorySlug}/permissions/{{}}'.format(projectKey=project_key, repositorySlug=repo_slug))
             return result
         else:
@@ -59,7 +110,43 @@ class Stash(Service):
             return result
             # TODO personal repo permissions?
 
+    def load_group_members(self, group):
+        return [user['name'] for user in self._get_pages('/rest/api/1.0/admin/groups/more-members?context={}'.format(quote(group)))]
+
     def _get_permissions(self, api):
+        """
+        Load all permissions of a project or repository, using the request mode we're configured for.
+        :param api: API URL with a placeholder for the last path segment, e.g. /rest/api/1.0/projects/KEY/permissions/{}
+        :rtype: list
+        """
+        if self.permission_mode == 'classic' or self._search_supported is False:
+            return list(self._get_classic_permissions(api))
+        try:
+            return list(self._get_bulk_permissions(api))
+        except HTTPError as e:
+            if self.permission_mode == 'bulk' or e.status_code not in (400, 404, 405):
+                raise
+            l.info("%s does not support permission search (error %d), falling back to classic permission requests.",
+                   self.name, e.status_code)
+            self._search_supported = False
+            return list(self._get_classic_permissions(api))
+
+    def _get_bulk_permissions(self, api):
+        """
+        Yield all user and group permissions of a project or repository from the permission search endpoint.
+        This needs one paged request per project or repository instead of two.
+        """
+        for value in self._get_pages(api.format('search')):
+            if 'user' in value:
+                yield PermissionEntry(value['permission'], value['user']['name'], None)
+            elif 'group' in value:
+                group = value['group']
+                yield PermissionEntry(value['permission'], None, group['name'] if isinstance(group, dict) else group)
+            else:
+                l.error('Could not match Stash permission to user or group', extra={'permission': value})
+        self._search_supported = True
+
+    def _get_classic_permissions(self, api):
         for api_endpoint, response_key in (('groups', 'group'),
                                                             ('users', 'user')):
             for value in self._get_pages(api.format(api_endpoint)):
@@ -69,20 +156,24 @@ class Stash(Service):
                     yield PermissionEntry(value['permission'], None, value[response_key]['name'])
 
     def _get_pages(self, url):
+        """
+        Yield all values of a paged Stash API resource, requesting as many values per page as the server allows.
+        Values are yielded page by page as they arrive.
+        """
         query_args = []
         split_url = urlsplit(url)
         if len(split_url.query) > 0:
             query_args.append(split_url.query)
+        query_args.append('limit={}'.format(self.PAGE_LIMIT))
         query_args.append('start={}')
         url = urljoin(url, '?' + '&'.join(query_args))
-        response = {'isLastPage': False}
-        values = []
         start = 0
-        while not response['isLastPage']:
+        while True:
             request = url.format(start)
-            l.debug("Will now request: " + request)
+            l.debug("Will now request: %s", request)
             response = self.client.get(request)
-            l.debug("Got a server response: " + str(response))
-            start = response['size'] - 1
-            values += response['values']
-        return values
+            l.debug("Got a server response: %s", response)
+            yield from response['values']
+            if response.get('isLastPage', True) or response.get('nextPageStart') is None:
+                break
+            start = response['nextPageStart']
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Crawl benchmark: crawls synthetic Jira, Stash and Confluence instances served by our mock server
+and records crawl time, request count and peak memory per run.
+
+The mock servers run in a separate process, so they don't skew our time and memory measurements.
+Every run is appended to a results file, see benchmark.results. Run from the repository root:
+
+  python -m benchmark.crawl --projects 500 --repos 2000 --workers 8 --latency 0.005
+"""
+
+from argparse import ArgumentParser
+import logging
+import multiprocessing
+import resource
+from threading import Event, Thread
+from time import perf_counter
+
+from atlassian.confluence import Confluence
+from atlassian.jira import Jira
+from atlassian.metrics import CrawlMetrics
+from atlassian.service_model import MyLittleAtlassianWorld
+from atlassian.stash import Stash
+
+from .results import parameters, peak_memory, previous_result, record_result
+from .mock_server import (MockAtlassianServer, add_instance_arguments, instance_from_arguments,
+                          server_options_from_arguments)
+
+
+l = logging.getLogger(__name__)
+
+SERVICES = ('jira', 'stash', 'confluence')
+
+
+def serve(args, services, ports):
+    """
+    Run one mock server per service until terminated. Reports their ports via the ports queue.
+    """
+    instance = instance_from_arguments(args)
+    for service in services:
+        server = MockAtlassianServer(instance, **server_options_from_arguments(args))
+        Thread(target=server.serve_forever, daemon=True).start()
+        ports.put((service, server.server_address[1]))
+    Event().wait()
+
+
+def start_servers(args, services):
+    """
+    :return: The server process and a dict mapping service names to server URLs
+    """
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    process = context.Process(target=serve, args=(args, services, ports), daemon=True)
+    process.start()
+    urls = dict()
+    for _ in services:
+        service, port = ports.get(timeout=600)  # generating large instances takes a while
+        urls[service] = 'http://127.0.0.1:{}'.format(port)
+    return process, urls
+
+
+def create_world(args, urls, metrics):
+    services = dict()
+    if 'jira' in urls:
+        services[Jira.name] = Jira(urls['jira'], name='Jira')
+    if 'stash' in urls:
+        services[Stash.name] = Stash(urls['stash'], name='Stash', permission_mode=args.stash_permissions)
+    if 'confluence' in urls:
+        services[Confluence.name] = Confluence(urls['confluence'], name='Confluence', api=args.confluence_api)
+    for key, service in services.items():
+        service.client_options['pool_size'] = args.workers
+        service.client_options['metrics'] = metrics.for_service(key)
+    return MyLittleAtlassianWorld(services)
+
+
+def crawl(args, urls):
+    """
+    Crawl all mock servers once.
+    :return: dict of measurements
+    """
+    metrics = CrawlMetrics()
+    world = create_world(args, urls, metrics)
+    for service in world.services.values():
+        service.login('bench', 'bench')
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = perf_counter()
+    world.refresh(workers=args.workers, host_limit=args.host_limit)
+    elapsed = perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    world.logout()
+
+    result = {'seconds': round(elapsed, 3),
+              'cpu_seconds': round(after.ru_utime + after.ru_stime - usage.ru_utime - usage.ru_stime, 3),
+              'services': dict()}
+    requests = dict()
+    for (service, method, endpoint), endpoint_metrics in metrics.items():
+        requests[service] = requests.get(service, 0) + endpoint_metrics.requests
+    for key, service in world.services.items():
+        result['services'][key] = {'projects': len(service.projects),
+                                   'permissions': sum(1 for _ in service.flat_permissions),
+                                   'requests': requests.get(key, 0)}
+    result['requests'] = sum(requests.values())
+    return result
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark crawling synthetic Atlassian instances.')
+    parser.add_argument('--services', default=','.join(SERVICES),
+                        help='Comma separated services to crawl. Default: ' + ','.join(SERVICES))
+    parser.add_argument('--workers', '-w', type=int, default=1)
+    parser.add_argument('--host-limit', type=int, default=None)
+    parser.add_argument('--stash-permissions', choices=Stash.PERMISSION_MODES, default='classic')
+    parser.add_argument('--confluence-api', choices=sorted(Confluence.APIS.keys()), default='rest')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of crawls; we record the fastest. Default: 1.')
+    parser.add_argument('--results', default='benchmark/results.jsonl',
+                        help='Append results to this file. Default: benchmark/results.jsonl')
+    parser.add_argument('--label', help='Free text to identify this run by, e.g. what you changed')
+    parser.add_argument('--loglevel', default='WARNING')
+    add_instance_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+
+    services = [service.strip() for service in args.services.split(',') if service.strip()]
+    unknown = set(services) - set(SERVICES)
+    if unknown:
+        parser.error('Unknown services: {}'.format(', '.join(sorted(unknown))))
+
+    process, urls = start_servers(args, services)
+    try:
+        runs = [crawl(args, urls) for _ in range(args.repeat)]
+    finally:
+        process.terminate()
+    best = min(runs, key=lambda run: run['seconds'])
+
+    params = parameters(args)
+    previous = previous_result(args.results, params)
+    record = record_result(args.results, dict(best, peak_memory_mb=peak_memory(),
+                                              all_seconds=[run['seconds'] for run in runs]),
+                           params, args.label)
+
+    print('{:.2f}s ({:.2f}s CPU), {} requests, peak memory {} MB'.format(
+        record['seconds'], record['cpu_seconds'], record['requests'], record['peak_memory_mb']))
+    for key, service in sorted(record['services'].items()):
+        print('  {}: {projects} projects, {permissions} permissions, {requests} requests'.format(key, **service))
+    if previous is not None:
+        print('Previous comparable run ({}, {}): {:.2f}s, {} requests, peak memory {} MB ({:+.1%} time)'.format(
+            previous.get('revision'), previous.get('time'), previous['seconds'], previous['requests'],
+            previous['peak_memory_mb'], record['seconds'] / previous['seconds'] - 1 if previous['seconds'] else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for Jira, Stash and Confluence, serving a synthetic instance of configurable size
+via exactly the REST, XML-RPC and JSON-RPC endpoints our services use.
+Every server answers all of them, so start one per service to get realistic per-host connection handling.
+
+Run it on its own to crawl it manually:
+
+  python -m benchmark.mock_server --port 8000 --projects 100
+  ./run.py -u bench -p bench --stash http://localhost:8000 --print
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import re
+import socket
+from threading import Lock
+from time import sleep
+from urllib.parse import parse_qs, unquote, urlsplit
+from xmlrpc.server import SimpleXMLRPCDispatcher
+
+
+l = logging.getLogger(__name__)
+
+JIRA_ROLES = ('Administrators', 'Developers', 'Users', 'Service Desk Team', 'Viewers')
+STASH_GLOBAL_PERMISSIONS = ('LICENSED_USER', 'PROJECT_CREATE', 'ADMIN', 'SYS_ADMIN')
+STASH_PROJECT_PERMISSIONS = ('PROJECT_READ', 'PROJECT_WRITE', 'PROJECT_ADMIN')
+STASH_REPO_PERMISSIONS = ('REPO_READ', 'REPO_WRITE', 'REPO_ADMIN')
+CONFLUENCE_OPERATIONS = (('read', 'space', 'VIEWSPACE'), ('administer', 'space', 'SETSPACEPERMISSIONS'),
+                         ('create', 'page', 'EDITSPACE'), ('create', 'comment', 'COMMENT'),
+                         ('create', 'attachment', 'CREATEATTACHMENT'), ('delete', 'page', 'REMOVEPAGE'))
+"""(REST operation, REST target type, XML-RPC permission name) of the space permissions we hand out"""
+
+
+class SyntheticInstance:
+    """
+    Deterministic fake Atlassian data. Projects, repositories and spaces are generated up front,
+    permissions on demand, seeded by the resource's key, so they're the same on every request and run.
+    """
+
+    def __init__(self, projects=5000, repos=20000, users=10000, groups=500, permissions=10, seed=0, group_size=20):
+        """
+        :param projects: number of Jira projects, Stash projects and Confluence spaces each
+        :param repos: number of Stash repositories, spread evenly over all Stash projects
+        :param permissions: number of user and group grants per project, repository and space
+        :param group_size: number of members per group
+        """
+        self.seed = seed
+        self.permissions = permissions
+        self.group_size = group_size
+        self.users = ['user{:05d}'.format(i) for i in range(users)]
+        self.groups = ['group{:04d}'.format(i) for i in range(groups)]
+        self.projects = ['P{:05d}'.format(i) for i in range(projects)]
+        self.repos = dict()
+        """Repository slugs by project key"""
+        for project in self.projects:
+            self.repos[project] = []
+        for i in range(repos):
+            self.repos[self.projects[i % projects]].append('repo-{:06d}'.format(i))
+
+    def grants(self, key, permission_names):
+        """
+        :return: list of (permission name, user or None, group or None) for the resource with this key
+        """
+        rng = random.Random('{}:{}'.format(self.seed, key))
+        result = []
+        for i in range(self.permissions):
+            permission = rng.choice(permission_names)
+            if i % 3 == 2 and self.groups:
+                result.append((permission, None, rng.choice(self.groups)))
+            else:
+                result.append((permission, rng.choice(self.users), None))
+        return result
+
+    def members(self, group):
+        """
+        :return: sorted list of the users in group
+        """
+        rng = random.Random('{}:members:{}'.format(self.seed, group))
+        return sorted(rng.sample(self.users, min(self.group_size, len(self.users))))
+
+
+class MockAtlassianServer(ThreadingHTTPServer):
+    """
+    Serves a SyntheticInstance. Thread per connection, keep-alive, like the real thing.
+    """
+    daemon_threads = True
+
+    def __init__(self, instance, port=0, latency=0.0, page_size=1000, stash_search=True, confluence_expand=True):
+        """
+        :param latency: seconds to wait before answering each request
+        :param page_size: maximum page size of paged resources, no matter what the client asks for
+        :param stash_search: whether to support Stash's permission search endpoint like newer servers do
+        :param confluence_expand: whether the Confluence space listing includes permissions when asked to expand them
+        """
+        super().__init__(('127.0.0.1', port), MockRequestHandler)
+        self.instance = instance
+        self.latency = latency
+        self.page_size = page_size
+        self.stash_search = stash_search
+        self.confluence_expand = confluence_expand
+
+        self.requests = 0
+        self._lock = Lock()
+
+        self.xmlrpc = SimpleXMLRPCDispatcher(allow_none=True)
+        self.xmlrpc.register_function(lambda user, password: 'token', 'confluence1.login')
+        self.xmlrpc.register_function(lambda token: True, 'confluence1.logout')
+        self.xmlrpc.register_function(lambda token: [space_data(key) for key in instance.projects], 'confluence1.getSpaces')
+        self.xmlrpc.register_function(lambda token, key: self.confluence_permission_sets(key),
+                                      'confluence1.getSpacePermissionSets')
+
+        self.routes = (
+            ('GET', r'/rest/api/1\.0/admin/groups/more-members', self.stash_group_members),
+            ('GET', r'/rest/api/2/group/member', self.jira_group_members),
+            ('GET', r'/rest/api/group/([^/]+)/member', self.confluence_group_members),
+            ('GET', r'/rest/api/1\.0/projects', self.stash_projects),
+            ('GET', r'/rest/api/1\.0/projects/([^/]+)/repos', self.stash_repos),
+            ('GET', r'/rest/api/1\.0/admin/permissions/(users|groups)', self.stash_global_permissions),
+            ('GET', r'/rest/api/1\.0/projects/([^/]+)/permissions/(users|groups|search)', self.stash_project_permissions),
+            ('GET', r'/rest/api/1\.0/projects/([^/]+)/repos/([^/]+)/permissions/(users|groups|search)',
+             self.stash_repo_permissions),
+            ('GET', r'/rest/api/2/project', self.jira_projects),
+            ('GET', r'/rest/api/2/role', self.jira_roles),
+            ('GET', r'/rest/api/2/project/([^/]+)/role', self.jira_project_roles),
+            ('GET', r'/rest/api/2/project/([^/]+)/role/(\d+)', self.jira_role_actors),
+            ('GET', r'/rest/api/space', self.confluence_spaces),
+            ('POST', r'/rpc/json-rpc/confluenceservice-v2/getSpacePermissionSets', self.confluence_jsonrpc_permissions),
+        )
+        self.routes = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in self.routes]
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def page(self, values, query):
+        """
+        :return: values sliced according to the limit and start query arguments, and the start of the next page or None
+        """
+        start = int(query.get('start', [0])[0])
+        limit = min(int(query.get('limit', [25])[0]), self.page_size)
+        end = start + limit
+        return values[start:end], (end if end < len(values) else None)
+
+    # Stash
+
+    def stash_paged(self, values, query):
+        page, next_start = self.page(values, query)
+        result = {'size': len(page), 'limit': len(page), 'start': int(query.get('start', [0])[0]),
+                  'isLastPage': next_start is None, 'values': page}
+        if next_start is not None:
+            result['nextPageStart'] = next_start
+        return result
+
+    def stash_projects(self, query, host):
+        return self.stash_paged([{'key': key, 'id': i, 'name': 'Project ' + key, 'public': False, 'type': 'NORMAL'}
+                                 for i, key in enumerate(self.instance.projects)], query)
+
+    def stash_repos(self, query, host, project):
+        if project not in self.instance.repos:
+            return 404
+        return self.stash_paged([{'slug': slug, 'name': slug, 'scmId': 'git', 'state': 'AVAILABLE',
+                                  'project': {'key': project}}
+                                 for slug in self.instance.repos[project]], query)
+
+    def stash_global_permissions(self, query, host, kind):
+        return self.stash_paged(self.stash_grants('STASH-GLOBAL', STASH_GLOBAL_PERMISSIONS, kind), query)
+
+    def stash_project_permissions(self, query, host, project, kind):
+        if project not in self.instance.repos:
+            return 404
+        return self.stash_permissions(project, STASH_PROJECT_PERMISSIONS, kind, query)
+
+    def stash_repo_permissions(self, query, host, project, slug, kind):
+        if slug not in self.instance.repos.get(project, ()):
+            return 404
+        return self.stash_permissions(project + '/' + slug, STASH_REPO_PERMISSIONS, kind, query)
+
+    def stash_permissions(self, key, permission_names, kind, query):
+        if kind == 'search' and not self.stash_search:
+            return 404
+        return self.stash_paged(self.stash_grants(key, permission_names, kind), query)
+
+    def stash_grants(self, key, permission_names, kind):
+        result = []
+        for permission, user, group in self.instance.grants(key, permission_names):
+            if user is not None and kind in ('users', 'search'):
+                result.append({'permission': permission, 'user': {'name': user, 'displayName': user.title()}})
+            elif group is not None and kind in ('groups', 'search'):
+                result.append({'permission': permission, 'group': {'name': group}})
+        return result
+
+    def stash_group_members(self, query, host):
+        group = query.get('context', [''])[0]
+        if group not in self.instance.groups:
+            return 404
+        return self.stash_paged([{'name': user, 'displayName': user.title()} for user in self.instance.members(group)], query)
+
+    # Jira
+
+    def jira_projects(self, query, host):
+        return [{'key': key, 'id': str(10000 + i), 'name': 'Project ' + key}
+                for i, key in enumerate(self.instance.projects)]
+
+    def jira_roles(self, query, host):
+        return [{'name': name, 'id': 10000 + i} for i, name in enumerate(JIRA_ROLES)]
+
+    def jira_project_roles(self, query, host, project):
+        if project not in self.instance.repos:
+            return 404
+        return {name: 'http://{}/rest/api/2/project/{}/role/{}'.format(host, project, 10000 + i)
+                for i, name in enumerate(JIRA_ROLES)}
+
+    def jira_role_actors(self, query, host, project, role_id):
+        index = int(role_id) - 10000
+        if project not in self.instance.repos or not 0 <= index < len(JIRA_ROLES):
+            return 404
+        name = JIRA_ROLES[index]
+        actors = []
+        for permission, user, group in self.instance.grants(project, JIRA_ROLES):
+            if permission != name:
+                continue
+            if user is not None:
+                actors.append({'type': 'atlassian-user-role-actor', 'name': user, 'displayName': user.title()})
+            else:
+                actors.append({'type': 'atlassian-group-role-actor', 'name': group, 'displayName': group})
+        return {'name': name, 'id': int(role_id), 'actors': actors}
+
+    def jira_group_members(self, query, host):
+        group = query.get('groupname', [''])[0]
+        if group not in self.instance.groups:
+            return 404
+        start = int(query.get('startAt', [0])[0])
+        limit = min(int(query.get('maxResults', [50])[0]), 50, self.page_size)
+        members = self.instance.members(group)
+        page = members[start:start + limit]
+        return {'startAt': start, 'maxResults': limit, 'total': len(members), 'isLast': start + limit >= len(members),
+                'values': [{'name': user, 'displayName': user.title(), 'active': True} for user in page]}
+
+    # Confluence
+
+    def confluence_spaces(self, query, host):
+        keys = self.instance.projects
+        if 'spaceKey' in query:
+            keys = [key for key in keys if key in query['spaceKey']]
+        page, next_start = self.page(keys, query)
+        expand = self.confluence_expand and 'permissions' in query.get('expand', [''])[0].split(',')
+        results = []
+        for key in page:
+            space = space_data(key)
+            if expand:
+                space['permissions'] = self.confluence_rest_permissions(key)
+            results.append(space)
+        links = {}
+        if next_start is not None:
+            links['next'] = '/rest/api/space?limit={}&start={}'.format(len(page), next_start)
+        return {'results': results, 'start': int(query.get('start', [0])[0]), 'size': len(results), '_links': links}
+
+    def confluence_group_members(self, query, host, group):
+        group = unquote(group)
+        if group not in self.instance.groups:
+            return 404
+        page, next_start = self.page(self.instance.members(group), query)
+        links = {}
+        if next_start is not None:
+            links['next'] = '/rest/api/group/{}/member?limit={}&start={}'.format(group, len(page), next_start)
+        return {'results': [{'type': 'known', 'username': user} for user in page],
+                'start': int(query.get('start', [0])[0]), 'size': len(page), '_links': links}
+
+    def confluence_rest_permissions(self, key):
+        names = {name: (operation, target) for operation, target, name in CONFLUENCE_OPERATIONS}
+        result = []
+        for permission, user, group in self.instance.grants(key, sorted(names)):
+            operation, target = names[permission]
+            subjects = {'user': {'results': [{'username': user}]}} if user is not None \
+                else {'group': {'results': [{'name': group}]}}
+            result.append({'operation': {'operation': operation, 'targetType': target},
+                           'subjects': subjects, 'anonymousAccess': False})
+        return result
+
+    def confluence_permission_sets(self, key):
+        sets = dict()
+        for permission, user, group in self.instance.grants(key, sorted(name for _, _, name in CONFLUENCE_OPERATIONS)):
+            grant = {'type': permission, 'userName': user} if user is not None else {'type': permission, 'groupName': group}
+            sets.setdefault(permission, []).append(grant)
+        return [{'type': permission, 'spacePermissions': grants} for permission, grants in sorted(sets.items())]
+
+    def confluence_jsonrpc_permissions(self, query, host, body):
+        return self.confluence_permission_sets(json.loads(body)[0])
+
+
+def space_data(key):
+    return {'key': key, 'name': 'Space ' + key, 'type': 'global', 'url': '/display/' + key}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # we write headers and body separately; don't let Nagle's algorithm hold back the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        server = self.server
+        server.count_request()
+        if server.latency:
+            sleep(server.latency)
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))) if method == 'POST' else None
+
+        if method == 'POST' and url.path == '/rpc/xmlrpc':
+            self.respond(200, server.xmlrpc._marshaled_dispatch(body), 'text/xml')
+            return
+        for route_method, pattern, handler in server.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                arguments = match.groups() + ((body,) if body is not None else ())
+                result = handler(parse_qs(url.query), self.headers.get('Host'), *arguments)
+                if isinstance(result, int):
+                    self.respond(result, b'{}')
+                else:
+                    self.respond(200, json.dumps(result).encode('utf-8'))
+                return
+        self.respond(404, b'{}')
+
+    def respond(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        l.debug(format, *args)
+
+
+def add_instance_arguments(parser):
+    """Add arguments describing a SyntheticInstance and its MockAtlassianServer to an ArgumentParser"""
+    instance = parser.add_argument_group('Synthetic instance')
+    instance.add_argument('--projects', type=int, default=5000,
+                          help='Number of Jira projects, Stash projects and Confluence spaces each. Default: 5000.')
+    instance.add_argument('--repos', type=int, default=20000, help='Number of Stash repositories. Default: 20000.')
+    instance.add_argument('--users', type=int, default=10000, help='Number of users. Default: 10000.')
+    instance.add_argument('--groups', type=int, default=500, help='Number of groups. Default: 500.')
+    instance.add_argument('--permissions', type=int, default=10,
+                          help='Number of grants per project, repository and space. Default: 10.')
+    instance.add_argument('--group-size', type=int, default=20, help='Number of members per group. Default: 20.')
+    instance.add_argument('--seed', type=int, default=0)
+    server = parser.add_argument_group('Mock server')
+    server.add_argument('--latency', type=float, default=0.0, help='Seconds to delay each response. Default: 0.')
+    server.add_argument('--page-size', type=int, default=1000,
+                        help='Maximum page size the server hands out. Default: 1000.')
+    server.add_argument('--no-stash-search', dest='stash_search', action='store_false',
+                        help="Act like an old Stash that doesn't support permission search.")
+    server.add_argument('--no-confluence-expand', dest='confluence_expand', action='store_false',
+                        help="Don't include permissions in the Confluence space listing.")
+
+
+def instance_from_arguments(args):
+    return SyntheticInstance(args.projects, args.repos, args.users, args.groups, args.permissions, args.seed,
+                             args.group_size)
+
+
+def server_options_from_arguments(args):
+    return {'latency': args.latency, 'page_size': args.page_size,
+            'stash_search': args.stash_search, 'confluence_expand': args.confluence_expand}
+
+
+def main():
+    parser = ArgumentParser(description='Serve a synthetic Jira, Stash and Confluence instance.')
+    parser.add_argument('--port', type=int, default=8000)
+    add_instance_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = MockAtlassianServer(instance_from_arguments(args), args.port, **server_options_from_arguments(args))
+    l.info('Serving on %s', server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
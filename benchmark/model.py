@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Model benchmark: builds synthetic MyLittleAtlassianWorld objects of increasing size in memory
+and times the views, the diff and snapshots on each, without any network involved.
+
+For every operation and size we report time, throughput in permission assignments per second
+and peak memory allocated, plus a scaling exponent between consecutive sizes:
+about 1 means the operation scales linearly, 2 means quadratically.
+Every run is appended to a results file, see benchmark.results. Run from the repository root:
+
+  python -m benchmark.model --sizes 250,1000,4000
+"""
+
+from argparse import ArgumentParser
+from functools import partial
+import gc
+import io
+import math
+import os
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from atlassian import snapshot
+from atlassian.confluence import Confluence
+from atlassian.jira import Jira
+from atlassian.permission_data import PermissionDict, PermissionEntry
+from atlassian.service_model import MyLittleAtlassianWorld, Project
+from atlassian.stash import Stash
+from view.csv import WorldCsvView
+from view.text import WorldTextView
+from view.html import WorldHtmlView
+
+from .mock_server import (CONFLUENCE_OPERATIONS, JIRA_ROLES, STASH_PROJECT_PERMISSIONS, STASH_REPO_PERMISSIONS,
+                          SyntheticInstance)
+from .results import parameters, previous_result, record_result
+
+
+REPOS_PER_PROJECT = 4
+
+
+def build_world(instance, changed_every=None):
+    """
+    Build a world holding the synthetic instance's Jira projects, Stash projects and repositories and Confluence spaces,
+    with all permissions loaded.
+    :param changed_every: if set, grant different permissions in every changed_every-th project,
+                          to get a world to diff against
+    """
+    services = {'Jira': Jira('http://jira.invalid', name='Jira'),
+                'Stash': Stash('http://stash.invalid', name='Stash'),
+                'Confluence': Confluence('http://confluence.invalid', name='Confluence')}
+    resources = {'Jira': [(key, JIRA_ROLES) for key in instance.projects],
+                 'Stash': [],
+                 'Confluence': [(key, sorted(name for _, _, name in CONFLUENCE_OPERATIONS)) for key in instance.projects]}
+    for key in instance.projects:
+        resources['Stash'].append((key, STASH_PROJECT_PERMISSIONS))
+        for slug in instance.repos[key]:
+            resources['Stash'].append((key + Stash.REPO_DELIM + slug, STASH_REPO_PERMISSIONS))
+
+    for service_key, service in services.items():
+        service._projects = dict()
+        for i, (key, permission_names) in enumerate(resources[service_key]):
+            project = Project(service, {'key': key, 'name': 'Project ' + key})
+            grant_key = key + ':changed' if changed_every and i % changed_every == 0 else key
+            project._permissions = PermissionDict()
+            for name, user, group in instance.grants(grant_key, permission_names):
+                project._permissions.add_permission(PermissionEntry(name, user, group))
+            project._permissions.compact()
+            service._projects[key] = project
+    return MyLittleAtlassianWorld(services)
+
+
+def assignments(world):
+    return sum(1 for _ in world.flat_permissions)
+
+
+def write_view(view):
+    view.write(io.StringIO())
+
+
+def save_and_load(world):
+    fd, filename = tempfile.mkstemp(suffix='.json.gz')
+    os.close(fd)
+    try:
+        snapshot.save(world, filename)
+        snapshot.load(filename)
+    finally:
+        os.remove(filename)
+
+
+OPERATIONS = (
+    ('build', None),
+    ('csv', lambda world, old: write_view(WorldCsvView(world))),
+    ('text', lambda world, old: write_view(WorldTextView(world))),
+    ('html', lambda world, old: write_view(WorldHtmlView(world))),
+    ('diff', lambda world, old: sum(1 for change in old.diff(world).changes())),
+    ('csv-diff', lambda world, old: write_view(WorldCsvView(world, diff='yes', cmp=old))),
+    ('html-diff', lambda world, old: write_view(WorldHtmlView(world, diff='only', cmp=old))),
+    ('snapshot', lambda world, old: save_and_load(world)),
+)
+"""Benchmarked operations by name. 'build' measures building the world itself."""
+
+
+def measure(function, memory):
+    """
+    :param memory: whether to trace memory allocations. Slows function down, so we measure time separately.
+    :return: (seconds, peak MB allocated or None, function's result)
+    """
+    gc.collect()
+    start = perf_counter()
+    result = function()
+    elapsed = perf_counter() - start
+    peak = None
+    if memory:
+        result = None
+        gc.collect()
+        tracemalloc.start()
+        result = function()
+        peak = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def run(args):
+    """
+    :return: dict mapping operation names to lists of measurements, one per size
+    """
+    selected = [name for name, function in OPERATIONS if name in args.operations]
+    results = {name: [] for name in selected}
+    for size in args.sizes:
+        instance = SyntheticInstance(size, size * REPOS_PER_PROJECT, args.users, args.groups, args.permissions, args.seed)
+        elapsed, peak, world = measure(lambda: build_world(instance), args.memory)
+        old = build_world(instance, changed_every=args.changed_every)
+        rows = assignments(world)
+        if 'build' in results:
+            results['build'].append(measurement(size, rows, elapsed, peak))
+        for name, function in OPERATIONS:
+            if function is None or name not in results:
+                continue
+            elapsed, peak, _ = measure(partial(function, world, old), args.memory)
+            results[name].append(measurement(size, rows, elapsed, peak))
+        del world, old
+    for measurements in results.values():
+        for previous, current in zip(measurements, measurements[1:]):
+            if previous['seconds'] > 0 and current['seconds'] > 0:
+                current['exponent'] = round(math.log(current['seconds'] / previous['seconds']) /
+                                            math.log(current['rows'] / previous['rows']), 2)
+    return results
+
+
+def measurement(size, rows, seconds, peak):
+    return {'size': size, 'rows': rows, 'seconds': round(seconds, 4),
+            'rows_per_second': round(rows / seconds) if seconds else None, 'peak_mb': peak}
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark views, diffs and snapshots of synthetic in-memory models.')
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')], default=[250, 1000, 4000],
+                        help='Comma separated numbers of projects per service to benchmark. ' +
+                             'Stash gets {} repositories per project on top. Default: 250,1000,4000'.format(REPOS_PER_PROJECT))
+    parser.add_argument('--operations', type=lambda value: value.split(','),
+                        default=[name for name, function in OPERATIONS],
+                        help='Comma separated operations to benchmark. Default: ' +
+                             ','.join(name for name, function in OPERATIONS))
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--permissions', type=int, default=10, help='Grants per project. Default: 10.')
+    parser.add_argument('--changed-every', type=int, default=10,
+                        help='For diffs, compare to a world where every nth project differs. Default: 10.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="Don't trace memory allocations, which runs every operation a second time.")
+    parser.add_argument('--results', default='benchmark/model_results.jsonl',
+                        help='Append results to this file. Default: benchmark/model_results.jsonl')
+    parser.add_argument('--label', help='Free text to identify this run by, e.g. what you changed')
+    args = parser.parse_args()
+    unknown = set(args.operations) - {name for name, function in OPERATIONS}
+    if unknown:
+        parser.error('Unknown operations: {}'.format(', '.join(sorted(unknown))))
+
+    results = run(args)
+    params = parameters(args)
+    previous = previous_result(args.results, params)
+    record_result(args.results, {'operations': results}, params, args.label)
+
+    print('{:<10} {:>7} {:>9} {:>9} {:>12} {:>9} {:>8} {:>9}'.format(
+        'Operation', 'Size', 'Rows', 'Seconds', 'Rows/s', 'Peak MB', 'Scaling', 'Previous'))
+    for name, measurements in results.items():
+        before = {m['size']: m for m in previous['operations'].get(name, ())} if previous is not None else {}
+        for m in measurements:
+            print('{:<10} {:>7} {:>9} {:>9.3f} {:>12} {:>9} {:>8} {:>9}'.format(
+                name, m['size'], m['rows'], m['seconds'], m['rows_per_second'] or '-',
+                '-' if m['peak_mb'] is None else m['peak_mb'], m.get('exponent', '-'),
+                '{:.3f}'.format(before[m['size']]['seconds']) if m['size'] in before else '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Recording benchmark results: every run is appended as a JSON line to a results file,
+together with the git revision it ran on, so regressions can be tracked between versions.
+"""
+
+import json
+import platform
+import resource
+import subprocess
+import sys
+from time import strftime
+
+
+def peak_memory():
+    """
+    :return: Peak resident memory of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 1)  # bytes on macOS, KB elsewhere
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parameters(args, ignore=('results', 'repeat', 'label', 'loglevel')):
+    """:return: everything that influences results, to tell which earlier runs are comparable"""
+    return {name: getattr(args, name) for name in sorted(vars(args)) if name not in ignore}
+
+
+def previous_result(filename, params):
+    """
+    :return: The last result recorded in filename with the same parameters, or None
+    """
+    result = None
+    try:
+        with open(filename, 'r', encoding='utf-8') as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('parameters') == params:
+                    result = record
+    except OSError:
+        pass
+    return result
+
+
+def record_result(filename, result, params, label=None):
+    """
+    Append result to filename, along with when and on what it ran.
+    :return: the complete record
+    """
+    record = dict(result, time=strftime('%Y-%m-%dT%H:%M:%S'), revision=revision(), label=label,
+                  python=platform.python_version(), parameters=params)
+    with open(filename, 'a', encoding='utf-8') as fd:
+        fd.write(json.dumps(record, sort_keys=True) + '\n')
+    return record
@@ -1,22 +1,34 @@
 #!/usr/bin/env python3.5
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
-from pprint import pprint, pformat
+import multiprocessing
+import os
+import sys
 from argparse import ArgumentParser
 from getpass import getpass
+from tempfile import TemporaryDirectory
+import time
+from urllib.parse import urlsplit
 
-import dill as pickle
-from deepdiff import DeepDiff
-
+from atlassian import HTTPClient, snapshot
 from atlassian.service_model import MyLittleAtlassianWorld
+from atlassian.http_cache import ResponseCache
+from atlassian.group_members import GroupMembership
+from atlassian.journal import CrawlJournal
+from atlassian.metrics import CrawlMetrics
+from atlassian.scheduler import RequestScheduler
 from atlassian.confluence import Confluence
 from atlassian.jira import Jira
 from atlassian.stash import Stash
 
-from view.csv import WorldCsvView
+from view import open_output
+from view.csv import WorldCsvView, EffectiveCsvView, CrawlCsvWriter
 from view.text import WorldTextView
 from view.html import WorldHtmlView
+from view.query import PrincipalQueryView
+from view.pipeline import RenderPipeline
 
 l = logging.getLogger(__name__)
 
@@ -33,6 +45,9 @@ class CliController:
         self.parser = ArgumentParser()
         self.args = None
 
+        self.membership = None
+        """GroupMembership of our world's groups if we resolve effective permissions"""
+
         """A MyLittleAtlassianWold object serving as root of our model"""
         self.world = None
 
@@ -49,15 +64,40 @@ class CliController:
                                              Add at least one Atlassian service to check. You can provide multiple instances of each kind.
                                              Please provide the complete URL including either http:// or https://, e.g. https://confluence.myserver.example.com.
                                              You can add a hint telling us the Confluence version you're running like this:
-                                             https://confluence.myserver.example.com,version=5.8.14''')
+                                             https://confluence.myserver.example.com,version=5.8.14
+                                             If you add several instances of a kind, they are named after their host;
+                                             pick a name yourself like this: https://jira.example.com,name=Jira-Sales''')
         services.add_argument('--confluence', '-c', help='Add Confluence instance.', action='append')
+        services.add_argument('--confluence-api', choices=sorted(Confluence.APIS.keys()), default='xmlrpc',
+                              help='Which Confluence API to use. "rest" pages through spaces via REST, expands their permissions ' +
+                                   'where the server supports it and loads the rest concurrently (see --workers). Default: xmlrpc.')
         services.add_argument('--jira', '-j', help='Add JIRA instance.', action='append')
         services.add_argument('--stash', '-s', help='Add Bitbucket Server instance, formerly known as Stash.', action='append')
+        services.add_argument('--service', metavar='NAME', action='append',
+                              help='Only look at this service, e.g. Jira-Sales, or all services of a kind, e.g. Jira. ' +
+                                   'Can be given multiple times.')
+        services.add_argument('--project', metavar='PATTERN', action='append',
+                              help='Only look at projects, spaces or repositories whose key matches this glob pattern, ' +
+                                   'e.g. DEMO, OPS-* or DEMO:web* for Stash repositories. Can be given multiple times. ' +
+                                   'Nothing below other projects is loaded, so spot checks are quick.')
+        services.add_argument('--stash-permissions', choices=Stash.PERMISSION_MODES, default='classic',
+                              help='How to load Stash permissions: "classic" (default) lists users and groups separately. ' +
+                                   '"bulk" uses the permission search endpoint (one request per repository), ' +
+                                   'which may also list grants implied by others, e.g. project permissions on repositories. ' +
+                                   '"auto" uses bulk where the server supports it.')
 
         action = self.parser.add_argument_group("Action", "What do you actually want to do?")
         action.add_argument('--csv', action='store_true', help='Export permissions as CSV')
         action.add_argument('--print', action='store_true', help='Pretty-Print permissions (plain text)')
         action.add_argument('--html', action='store_true', help='Export permissions as HTML')
+        action.add_argument('--query-user', metavar='USER', action='append',
+                            help='List all permissions granted to this user. Can be given multiple times.')
+        action.add_argument('--query-group', metavar='GROUP', action='append',
+                            help='List all permissions granted to this group. Can be given multiple times.')
+        action.add_argument('--effective', action='store_true',
+                            help='Resolve group members to show effective permissions: --csv lists every user holding a permission, ' +
+                                 'directly or through a group, and --query-user includes permissions granted to the user\'s groups. ' +
+                                 'Looks up each group once per service.')
 
         optional = self.parser.add_argument_group("optional arguments")
         optional.add_argument('--compare', '-cmp',
@@ -65,25 +105,107 @@ class CliController:
                                    "Will compare to a file previously saved with --save." +
                                    "Provide this file's name here.")
         optional.add_argument('--diff', action='store_true', help="Use together with cmp and an output action to show changes only.")
-        optional.add_argument('--save', '-S', help='Save to internal file. This allows you to do further analysis with this script without re-crawling everything.')
+        optional.add_argument('--save', '-S', help='Save to internal file. This allows you to do further analysis with this script without re-crawling everything. ' +
+                                                   'Compressed if the file name ends in .gz.')
         optional.add_argument('--load', '-L', help='Load from file. This allows you to do further analysis with this script without re-crawling everything.')
-        optional.add_argument('--output', '-o', help='Write output to this file. Will print to console if omitted.')
+        optional.add_argument('--incremental', '-I', metavar='FROM_SNAPSHOT',
+                              help='Crawl incrementally based on a file previously saved with --save: ' +
+                                   'only load permissions of projects that are new or whose project data changed since then. ' +
+                                   'Permission changes that do not touch a project\'s data, e.g. a user or group added to a role, ' +
+                                   'are NOT detected: such projects keep their old permissions and are marked as carried over ' +
+                                   'in text and HTML output. Run a full crawl regularly to catch them.')
+        optional.add_argument('--output', '-o', help='Write output to this file. Will print to console if omitted. ' +
+                                                     'If you request several formats, they are written concurrently, ' +
+                                                     'each to a file named after this one with its own extension, ' +
+                                                     'e.g. report.csv and report.html for -o report.')
         optional.add_argument('--loglevel', '-l', default='WARNING', help="Loglevel", action='store')
         optional.add_argument('--header', help='For CSV export, include a header line', action='store_true')
+        optional.add_argument('--html-split', metavar='PROJECTS', type=int, nargs='?', const=0,
+                              help='For HTML export, write an index to the --output file linking to one page per service, ' +
+                                   'or to pages of at most PROJECTS projects each. For reports too large for a browser.')
+        optional.add_argument('--stream', action='store_true',
+                              help='For CSV export, write rows while crawling, as soon as each project is loaded. ' +
+                                   'Rows will not be sorted. Write to a file ending in .gz to compress.')
+        optional.add_argument('--workers', '-w', type=int, default=1,
+                              help='Number of concurrent permission requests per service. Services are crawled in parallel if this is larger than 1.')
+        optional.add_argument('--cache', metavar='DIR',
+                              help='Cache HTTP responses in this directory, so repeated runs only download changed resources.')
+        optional.add_argument('--cache-ttl', type=int, default=3600,
+                              help='Seconds to use cached responses without asking the server whether they changed. Default: 3600.')
+        optional.add_argument('--cache-size', type=int, default=512,
+                              help='Maximum cache size in MB. Least recently used responses are evicted beyond this. Default: 512.')
+        optional.add_argument('--journal', metavar='FILE',
+                              help='Record every finished project in this file while crawling. Deleted once the crawl succeeds.')
+        optional.add_argument('--resume', action='store_true',
+                              help='Resume a crawl that died, skipping all unchanged projects recorded in the --journal file.')
+        optional.add_argument('--processes', type=int, default=1,
+                              help='Crawl each service in its own worker process, up to this many at once, ' +
+                                   'to use several CPU cores for fleets of many instances. Rate and host limits apply per process. ' +
+                                   'Prints the time spent on each service to stderr.')
+        optional.add_argument('--host-limit', type=int, default=None,
+                              help='Maximum number of projects loading their permissions concurrently per host, ' +
+                                   'shared by all services on that host. This counts projects, not HTTP requests: ' +
+                                   'Jira looks up the roles of the projects being loaded with up to 4 extra requests at once. ' +
+                                   'Use --rate to limit requests.')
+        optional.add_argument('--rate', type=float, default=None,
+                              help='Maximum average number of requests per second per host. Default: unlimited.')
+        optional.add_argument('--max-retries', type=int, default=5,
+                              help='How often to retry requests that failed because the server was overloaded or unreachable. Default: 5.')
+        optional.add_argument('--timeout', type=float, default=HTTPClient.DEFAULT_TIMEOUT,
+                              help='Seconds to wait for a connection or for data from a server before retrying the request. ' +
+                                   'Default: {}.'.format(HTTPClient.DEFAULT_TIMEOUT))
+        optional.add_argument('--adaptive', action='store_true',
+                              help='Adapt the number of concurrent requests per host to its response times, ' +
+                                   'backing off when it slows down. Never exceeds --host-limit or --workers.')
+        optional.add_argument('--metrics', metavar='FILE', nargs='?', const='-',
+                              help='Measure requests per service and endpoint: counts, latencies, bytes and retries. ' +
+                                   'Prints a summary to stderr, or exports to FILE: as JSON if it ends in .json, ' +
+                                   'in Prometheus text format otherwise.')
 
     def parse_arguments(self):
         self.args = self.parser.parse_args()
 
-        if not (self.args.print or self.args.csv or self.args.save or self.args.html):
+        if not (self.args.print or self.args.csv or self.args.save or self.args.html or
+                self.args.query_user or self.args.query_group):
             self.parser.error("Please specify at least one action. You do want this script to actually do something, right?")
 
         if not (self.args.load or self.args.user):
             self.parser.error("Please specify a user name.")
 
-        # Can't output diff as CSV as we're currently using DeepDiff's output format and our CSV exporter doesn't support it.
-        # TODO: fix this
-        if self.args.compare and (self.args.csv):
-            self.parser.error("Error: This tool currently can't export comparisons as CSV. --html or --print should work.")
+        if self.args.stream and not self.args.csv:
+            self.parser.error("--stream only works with --csv.")
+
+        if self.args.stream and (self.args.load or self.args.compare):
+            self.parser.error("--stream writes permissions while crawling, so it can't be combined with --load or --compare.")
+
+        if self.args.html_split is not None and not (self.args.html and self.args.output):
+            self.parser.error("--html-split needs --html and an --output file to write the index to.")
+
+        if self.args.html_split is not None and self.args.html_split < 0:
+            self.parser.error("--html-split needs a positive number of projects per page.")
+
+        if self.args.effective and (self.args.load or self.args.compare or self.args.stream):
+            self.parser.error("--effective looks up group members on the live services; " +
+                              "it can't be combined with --load, --compare or --stream.")
+
+        if self.args.resume and not self.args.journal:
+            self.parser.error("--resume needs the --journal file of the crawl to resume.")
+
+        if self.args.resume and self.args.incremental:
+            self.parser.error("--resume and --incremental can't be combined.")
+
+        if self.args.load and self.args.incremental:
+            self.parser.error("--load and --incremental can't be combined; --incremental already loads its snapshot.")
+
+        if self.args.workers < 1 or (self.args.host_limit is not None and self.args.host_limit < 1) or self.args.processes < 1:
+            self.parser.error("--workers, --host-limit and --processes must be at least 1.")
+
+        if self.args.processes > 1 and (self.args.stream or self.args.journal):
+            self.parser.error("--stream and --journal follow the crawl as it happens, " +
+                              "so they can't be combined with crawling in several --processes.")
+
+        if (self.args.rate is not None and self.args.rate <= 0) or self.args.max_retries < 0 or self.args.timeout <= 0:
+            self.parser.error("--rate and --timeout must be positive and --max-retries must not be negative.")
 
         # Set log level
         loglevel = getattr(logging, self.args.loglevel.upper(), None)
@@ -93,22 +215,77 @@ class CliController:
 
         # Create model
         if self.args.load:   # ...or get a ready-made one from disk?
-            with open(self.args.load, 'rb') as fd:
-                self.world = pickle.load(fd)
+            self.world = snapshot.load(self.args.load)
+            self.world.restrict(self.args.service, self.args.project)
         else:
             password = self.get_password()
             self.world = self.create_services(self.args.confluence, self.args.jira, self.args.stash)
-            for service in self.world.services.values():  # TODO beautify
-                service.login(self.args.user, password)
-            self.world.refresh()
+            self.world.restrict(self.args.service, self.args.project)
+            if not self.world.services:
+                self.parser.error("--service didn't match any of the services you added.")
+            cache, scheduler, metrics = self.create_clients()
+            previous = None
+            if self.args.incremental:
+                previous = snapshot.load(self.args.incremental)
+            elif self.args.resume and os.path.exists(self.args.journal):
+                previous = CrawlJournal.read(self.args.journal)
+            retries = 0
+            if self.args.processes > 1:
+                retries = self.run_sharded_crawl(password, previous, metrics)
+                if self.args.effective:  # group members are looked up right here
+                    self.login_services(password, cache, scheduler, metrics)
+            else:
+                self.login_services(password, cache, scheduler, metrics)
+                self.run_crawl(previous)
+            if self.args.effective:
+                self.membership = GroupMembership(self.world, workers=self.args.workers)
+                self.membership.load()
+            if cache is not None:
+                cache.log_stats()
+            if scheduler.retries + retries:
+                l.warning('Retried %d requests.', scheduler.retries + retries)
+            if metrics is not None:
+                if self.args.metrics == '-':
+                    sys.stderr.write(metrics.summary())
+                else:
+                    metrics.export(self.args.metrics)
+
+    def create_clients(self):
+        """
+        :return: The response cache, request scheduler and metrics to share between all services, as requested.
+                 cache and metrics are None unless requested.
+        """
+        cache = None
+        if self.args.cache:
+            cache = ResponseCache(self.args.cache, ttl=self.args.cache_ttl, max_size=self.args.cache_size * 1024 * 1024)
+        scheduler = RequestScheduler(rate=self.args.rate, max_retries=self.args.max_retries,
+                                     max_concurrency=(self.args.host_limit or self.args.workers) if self.args.adaptive else None)
+        metrics = CrawlMetrics() if self.args.metrics else None
+        return cache, scheduler, metrics
+
+    def login_services(self, password, cache, scheduler, metrics=None):
+        """
+        Configure the HTTP clients of all our services and log in.
+        """
+        for key, service in self.world.services.items():  # TODO beautify
+            service.client_options['pool_size'] = self.args.workers
+            service.client_options['cache'] = cache
+            service.client_options['scheduler'] = scheduler
+            service.client_options['timeout'] = self.args.timeout
+            if metrics is not None:
+                service.client_options['metrics'] = metrics.for_service(key)
+            service.login(self.args.user, password)
 
     def run_action(self):
-        if self.args.compare:  # special case, we prevented any other output than plain text in parse_arguments()
+        if self.args.compare:
             self.run_compare()
         else:
             self.run_listperms()
 
-        if self.args.save:  # Save model as pickle. Independent of any other action.
+        if self.args.query_user or self.args.query_group:
+            self.run_query()
+
+        if self.args.save:  # Save model as snapshot. Independent of any other action.
             self.run_save()
 
     def run_compare(self):
@@ -121,36 +298,111 @@ class CliController:
         else:
             diff = 'yes'
 
-        if self.args.print:
-            with open(self.args.compare, 'rb') as pickle_file:
-                current_permissions = self.world.permissions
-                previous_world = pickle.load(pickle_file)
-                previous_permissions = previous_world.permissions
-                permissions = DeepDiff(previous_permissions, current_permissions, ignore_order=True)
-                if self.args.output:
-                    with open(self.args.output, 'w') as out_file:
-                        out_file.write(pformat(permissions))
+        previous_world = snapshot.load(self.args.compare)
+
+        view_map = (
+            (self.args.csv, WorldCsvView, 'csv'),
+            (self.args.print, WorldTextView, 'txt'),
+            (self.args.html, WorldHtmlView, 'html'))
+        pipeline = RenderPipeline(self.world, cmp=previous_world)
+        for arg, view_class, extension in view_map:
+            if arg:
+                self.add_view(pipeline, view_class(pipeline.model, cmp=pipeline.cmp, diff=diff), extension)
+        pipeline.run()
+
+    def run_crawl(self, previous=None):
+        """
+        Load all permissions via network, recording progress in a journal if requested.
+        :param previous: an older MyLittleAtlassianWorld to crawl incrementally against
+        """
+        journal = None
+        if self.args.journal:
+            journal = CrawlJournal(self.args.journal, append=self.args.resume)
+            for service in self.world.services.values():
+                service.add_listener(journal)
+
+        succeeded = False
+        try:
+            if self.args.stream:
+                self.run_stream_csv(previous)
+            else:
+                self.world.refresh(workers=self.args.workers, host_limit=self.args.host_limit, previous=previous)
+            succeeded = True
+        finally:
+            if journal is not None:
+                for service in self.world.services.values():
+                    service.remove_listener(journal)
+                if succeeded:
+                    journal.discard()
                 else:
-                    pprint(permissions)
-                # TODO: use model-level diff, remove view implementation from this controller
-        else:  # TODO remove redundant code
-            with open(self.args.compare, 'rb') as pickle_file:
-                current_permissions = self.world.permissions
-                previous_world = pickle.load(pickle_file)
-                previous_permissions = previous_world.permissions
-                permissions = DeepDiff(previous_permissions, current_permissions, ignore_order=True)
-
-                view_map = (
-                    (self.args.csv, WorldCsvView),
-                    (self.args.print, WorldTextView),
-                    (self.args.html, WorldHtmlView))
-                for arg, view_class in view_map:
-                    if arg:
-                        view = view_class(self.world, cmp=previous_world, diff=diff)
-                        if self.args.output:
-                            view.export(self.args.output)
-                        else:
-                            view.print()
+                    journal.close()
+                    l.error("Crawl failed. Run again with --resume to continue where it stopped.")
+
+    def run_sharded_crawl(self, password, previous=None, metrics=None):
+        """
+        Crawl each service in its own worker process, at most --processes at once, and merge them into our world.
+        Every process logs in by itself and saves its service to a snapshot we read back once it's done.
+        Writes a summary of the time spent on each service to stderr.
+        :param previous: an older MyLittleAtlassianWorld to crawl incrementally against
+        :param metrics: CrawlMetrics to add the worker processes' request metrics to
+        :return: The number of requests the worker processes retried
+        """
+        service_keys = sorted(self.world.services.keys())
+        results = dict()  # service key -> (seconds, number of projects, retries)
+        start = time.perf_counter()
+        with TemporaryDirectory(prefix='atlassian-permissions-') as directory:
+            context = multiprocessing.get_context('spawn')  # don't inherit our threads and connections
+            with ProcessPoolExecutor(max_workers=min(self.args.processes, len(service_keys)), mp_context=context) as pool:
+                futures = dict()
+                for number, service_key in enumerate(service_keys):
+                    previous_filename = None
+                    previous_service = self.world.previous_service(previous, service_key)
+                    if previous_service is not None:
+                        previous_filename = os.path.join(directory, 'previous-{}.json'.format(number))
+                        snapshot.save(MyLittleAtlassianWorld({service_key: previous_service}), previous_filename)
+                    filename = os.path.join(directory, 'service-{}.json'.format(number))
+                    future = pool.submit(crawl_service, self.args, password, service_key, previous_filename, filename)
+                    futures[future] = service_key, filename
+                for future in as_completed(futures):
+                    service_key, filename = futures[future]
+                    seconds, projects, retries, endpoint_metrics = future.result()
+                    results[service_key] = seconds, projects, retries
+                    if metrics is not None:
+                        metrics.merge(endpoint_metrics)
+                    self.world.merge(snapshot.load(filename))
+                    l.info('%s: crawled %d projects in %.1fs.', service_key, projects, seconds)
+
+        width = max(len('Service'), *(len(key) for key in service_keys))
+        lines = ['{:<{}} {:>8} {:>7} {:>9}'.format('Service', width, 'Projects', 'Retries', 'Seconds')]
+        for service_key in service_keys:
+            seconds, projects, retries = results[service_key]
+            lines.append('{:<{}} {:>8} {:>7} {:>9.2f}'.format(service_key, width, projects, retries, seconds))
+        lines.append('{} services crawled in {:.2f}s using {} processes'.format(
+            len(service_keys), time.perf_counter() - start, min(self.args.processes, len(service_keys))))
+        sys.stderr.write('\n'.join(lines) + '\n')
+        return sum(retries for seconds, projects, retries in results.values())
+
+    def run_stream_csv(self, previous=None):
+        """
+        Crawl and write CSV rows for each project as soon as it is loaded.
+        Projects carried over from previous in an incremental crawl are written once the crawl has finished.
+        """
+        filename = self.output_filename('csv')
+        if filename:
+            stream = open_output(filename)
+        else:
+            stream = sys.stdout
+        try:
+            csv_writer = CrawlCsvWriter(stream)
+            for service in self.world.services.values():
+                service.add_listener(csv_writer)
+            self.world.refresh(workers=self.args.workers, host_limit=self.args.host_limit, previous=previous)
+            for service in self.world.services.values():
+                service.remove_listener(csv_writer)
+            csv_writer.finish(self.world)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
 
     def run_listperms(self):
         """
@@ -158,24 +410,62 @@ class CliController:
         (e.g. --html for an HTML or --print for a plain text view).
         """
         view_map = (
-            (self.args.csv, WorldCsvView),
-            (self.args.print, WorldTextView),
-            (self.args.html, WorldHtmlView))
-        for arg, view_class in view_map:
+            (self.args.csv and not self.args.stream and not self.args.effective, WorldCsvView, 'csv'),
+            (self.args.print, WorldTextView, 'txt'),
+            (self.args.html, WorldHtmlView, 'html'))
+        pipeline = RenderPipeline(self.world)
+        for arg, view_class, extension in view_map:
             if arg:
-                view = view_class(self.world)
-                if self.args.output:
-                    view.export(self.args.output)
-                else:
-                    view.print()
+                self.add_view(pipeline, view_class(pipeline.model), extension)
+        if self.args.csv and self.args.effective:
+            self.add_view(pipeline, EffectiveCsvView(pipeline.model, self.membership), 'csv')
+        pipeline.run()
+
+    def add_view(self, pipeline, view, extension):
+        """
+        Add a job to pipeline writing view to its output file, or printing it if there's none.
+        """
+        filename = self.output_filename(extension)
+        if filename is None:
+            pipeline.add(view.print, concurrent=False)
+        elif isinstance(view, WorldHtmlView) and self.args.html_split is not None:
+            pipeline.add(lambda: view.export_pages(filename, self.args.html_split or None))
+        else:
+            pipeline.add(lambda: view.export(filename))
+
+    def output_filename(self, extension):
+        """
+        :return: The file to write the report with this extension to, or None to print it.
+                 If several reports are requested, each gets its own file named after --output:
+                 e.g. report.csv and report.html for --output report.
+        """
+        if not self.args.output:
+            return None
+        if sum(1 for arg in (self.args.csv, self.args.print, self.args.html) if arg) <= 1:
+            return self.args.output
+        filename, compressed = self.args.output, ''
+        if filename.endswith('.gz'):
+            filename, compressed = filename[:-3], '.gz'
+        root, current = os.path.splitext(filename)
+        if current.lower() in ('.csv', '.txt', '.html', '.htm'):
+            filename = root
+        return '{}.{}{}'.format(filename, extension, compressed)
+
+    def run_query(self):
+        """
+        Runs a query action, listing everything the requested users and groups were granted.
+        Always prints, so it can be combined with exporting reports to --output.
+        """
+        view = PrincipalQueryView(self.world, users=self.args.query_user or (), groups=self.args.query_group or (),
+                                  membership=self.membership)
+        view.print()
 
     def run_save(self):
         """
-        Saves current state to a pickle file.
+        Saves current state to a snapshot file. Compressed if the file name ends in .gz.
         """
-        with open(self.args.save, 'wb') as fd:
-            self.world.logout()
-            pickle.dump(self.world, fd)
+        self.world.logout()
+        snapshot.save(self.world, self.args.save)
 
     def get_password(self):
         password = None
@@ -197,20 +487,77 @@ class CliController:
         :return An object representing an ecosystem of Atlassian services
         """
         services = dict()
-        for arguments, service, name in ((confluence, Confluence, "Confluence"), (jira, Jira, "Jira"), (stash, Stash, "Stash")):
-            # TODO: support custom names
+        confluence_options = {'api': self.args.confluence_api}
+        stash_options = {'permission_mode': self.args.stash_permissions}
+        for arguments, service, name, options in ((confluence, Confluence, "Confluence", confluence_options),
+                                                  (jira, Jira, "Jira", {}),
+                                                  (stash, Stash, "Stash", stash_options)):
             if arguments is not None:
-                for uri in arguments:
+                for argument in arguments:
+                    uri, uri_options = self.parse_service_uri(argument)
                     # validate URL:
                     if not (uri.startswith("http://") or uri.startswith("https://")):
                         self.parser.error("Please provide the complete URLs of your Atlassian instances, starting either in http:// or https://.")
 
                     #TODO: remove? this version stuff is rather quirky and currently unused. We should get the version from API anyway
                     version = None
-                    if ',version=' in uri:
-                        versionstr = uri.split(',')[-1]
-                        version = tuple(versionstr.split('=')[-1].split('.'))
-                        uri = ','.join(uri.split(',')[:-1])
-                    services[service.name] = service(uri, name=name, version=version)
+                    if 'version' in uri_options:
+                        version = tuple(uri_options['version'].split('.'))
+
+                    if 'name' in uri_options:
+                        key = uri_options['name']
+                    elif len(arguments) == 1:
+                        key = name
+                    else:  # several instances of this kind, tell them apart by host
+                        location = urlsplit(uri)
+                        key = '{} {}{}'.format(name, location.netloc, location.path.rstrip('/'))
+                    if key.lower() in (existing.lower() for existing in services.keys()):
+                        self.parser.error("You added several services called {}. ".format(key) +
+                                          "Please name them apart by adding ,name=... to their URLs.")
+                    services[key] = service(uri, name=key, version=version, **options)
         world = MyLittleAtlassianWorld(services)
         return world
+
+    def parse_service_uri(self, argument):
+        """
+        Split a service argument like https://jira.example.com,name=Jira-Sales,version=7.2 into its URL and options.
+        :return: URL, dict of options
+        """
+        uri, *parts = argument.split(',')
+        options = dict()
+        for part in parts:
+            option, separator, value = part.partition('=')
+            if not separator or option not in ('name', 'version'):
+                self.parser.error("Unknown service option {} in {}. Use name=... or version=...".format(part, argument))
+            options[option] = value
+        return uri, options
+
+
+def crawl_service(args, password, service_key, previous_filename, filename):
+    """
+    Worker process of a crawl with several --processes: crawl a single service and save it as snapshot.
+    :param args: our parsed command line
+    :param service_key: which of the services on the command line to crawl
+    :param previous_filename: snapshot of an older copy of this service to crawl incrementally against, or None
+    :param filename: where to save the crawled service
+    :return: seconds spent, number of projects, number of retried requests
+             and request metrics as in CrawlMetrics.items(), if requested
+    """
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    start = time.perf_counter()
+    controller = CliController()
+    controller.args = args
+    controller.world = controller.create_services(args.confluence, args.jira, args.stash)
+    controller.world.services = {service_key: controller.world.services[service_key]}
+    controller.world.restrict(project_patterns=args.project)
+    cache, scheduler, metrics = controller.create_clients()
+    controller.login_services(password, cache, scheduler, metrics)
+    previous = snapshot.load(previous_filename) if previous_filename else None
+    controller.world.refresh(workers=args.workers, host_limit=args.host_limit, previous=previous)
+    controller.world.logout()
+    snapshot.save(controller.world, filename)
+    if cache is not None:
+        cache.log_stats()
+    service = controller.world.services[service_key]
+    return (time.perf_counter() - start, len(service.projects), scheduler.retries,
+            metrics.items() if metrics is not None else None)
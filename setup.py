@@ -11,7 +11,7 @@ setup(
     description='Extract Atlassian permissions',
     author='Sýlvan Heuser, Victor Hahn Castell',
     author_email='victor.hahn@flexoptix.net',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmark', 'benchmark.*', 'tests', 'tests.*']),
     scripts=['run.py'],
     install_requires=required
 )
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from controller.cli import CliController
+
+
+class OutputFilenameTest(unittest.TestCase):
+    def controller(self, *arguments):
+        controller = CliController()
+        controller.prepare_arguments()
+        controller.args = controller.parser.parse_args(['--user', 'admin'] + list(arguments))
+        return controller
+
+    def test_single_format_keeps_output(self):
+        controller = self.controller('--html', '-o', 'report.out')
+        self.assertEqual(controller.output_filename('html'), 'report.out')
+
+    def test_several_formats_get_own_files(self):
+        controller = self.controller('--csv', '--html', '-o', 'report.gz')
+        self.assertEqual(controller.output_filename('csv'), 'report.csv.gz')
+        self.assertEqual(controller.output_filename('html'), 'report.html.gz')
+
+    def test_streamed_csv_counts_as_format(self):
+        controller = self.controller('--csv', '--stream', '--html', '-o', 'report.csv')
+        self.assertEqual(controller.output_filename('csv'), 'report.csv')
+        self.assertEqual(controller.output_filename('html'), 'report.html')
+
+    def test_prints_without_output(self):
+        controller = self.controller('--csv', '--html')
+        self.assertIsNone(controller.output_filename('csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
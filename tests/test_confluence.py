@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from atlassian.confluence import Confluence
+
+
+class FakeClient:
+    """Answers space listings with the permissions of a single space expanded"""
+
+    def __init__(self, users):
+        self.users = users
+
+    def get(self, url):
+        permissions = [{'operation': {'operation': 'read', 'targetType': 'space'},
+                        'subjects': {'user': {'results': [{'username': user} for user in self.users]}}}]
+        return {'results': [{'key': 'DEMO', 'name': 'Demo', 'permissions': permissions}], '_links': {}}
+
+
+def crawl(users, previous=None):
+    confluence = Confluence('https://confluence.example.com', api='rest')
+    confluence.api.client = FakeClient(users)
+    confluence._logged_in = True
+    confluence.refresh_permissions(previous)
+    return confluence
+
+
+class IncrementalCrawlTest(unittest.TestCase):
+    def test_prefetched_permissions_are_not_carried_over(self):
+        previous = crawl(['alice'])
+        current = crawl(['bob'], previous)
+        self.assertEqual(list(current.flat_permissions), [('DEMO', 'VIEWSPACE', 'User', 'bob')])
+        self.assertFalse(current.api.prefetched('DEMO'))
+
+
+if __name__ == '__main__':
+    unittest.main()
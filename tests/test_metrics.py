@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from atlassian.metrics import endpoint_pattern
+
+
+class EndpointPatternTest(unittest.TestCase):
+    def test_identifiers(self):
+        self.assertEqual(endpoint_pattern('https://jira.example.com/rest/api/2/project/DEMO/role/10002',
+                                          'https://jira.example.com'),
+                         'rest/api/2/project/{}/role/{}')
+        self.assertEqual(endpoint_pattern('/rest/api/1.0/projects/DEMO/repos/web/permissions/search?limit=1000'),
+                         'rest/api/1.0/projects/{}/repos/{}/permissions/search')
+        self.assertEqual(endpoint_pattern('https://wiki.example.com/confluence/rest/api/group/developers/member',
+                                          'https://wiki.example.com/confluence/'),
+                         'rest/api/group/{}/member')
+
+    def test_endpoint_names(self):
+        self.assertEqual(endpoint_pattern('/rest/api/2/group/member?groupname=developers&startAt=0'),
+                         'rest/api/2/group/member')
+        self.assertEqual(endpoint_pattern('/rest/api/1.0/admin/groups/more-members?context=developers'),
+                         'rest/api/1.0/admin/groups/more-members')
+        self.assertEqual(endpoint_pattern('/rest/api/1.0/admin/permissions/users'),
+                         'rest/api/1.0/admin/permissions/users')
+
+
+if __name__ == '__main__':
+    unittest.main()
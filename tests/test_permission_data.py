@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from atlassian.permission_data import PermissionDict, PermissionEntry
+
+
+class PermissionDictTest(unittest.TestCase):
+    def setUp(self):
+        self.permissions = PermissionDict()
+        for name in ('a', 'b'):
+            self.permissions.add_permission(PermissionEntry(name, {'alice'}))
+        self.permissions.flatten()  # fill the cache
+
+    def assertNames(self, names):
+        self.assertEqual([name for name, type, assignee in self.permissions.flatten()], names)
+
+    def test_add(self):
+        self.permissions.add_permission(PermissionEntry('c', {'alice'}))
+        self.assertNames(['a', 'b', 'c'])
+
+    def test_mutations_invalidate_cache(self):
+        mutations = {
+            'del': lambda d: d.__delitem__('b'),
+            'pop': lambda d: d.pop('b'),
+            'popitem': lambda d: d.popitem(),
+            'clear': lambda d: d.clear(),
+            'update': lambda d: d.update(c=PermissionEntry('c', {'alice'})),
+            'ior': lambda d: d.__ior__({'c': PermissionEntry('c', {'alice'})}),
+            'setdefault': lambda d: d.setdefault('c', PermissionEntry('c', {'alice'})),
+        }
+        for name, mutation in mutations.items():
+            with self.subTest(name):
+                self.setUp()
+                version = self.permissions.version
+                mutation(self.permissions)
+                self.assertGreater(self.permissions.version, version)
+                self.assertNames(sorted(self.permissions.keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import tempfile
+import unittest
+
+try:
+    import dill
+except ImportError:
+    dill = None
+
+from atlassian import snapshot
+from atlassian.jira import Jira
+from atlassian.permission_data import PermissionDict, PermissionEntry
+from atlassian.service_model import MyLittleAtlassianWorld, Project
+from view.query import PrincipalQueryView
+
+
+def legacy_world():
+    """
+    :return: A MyLittleAtlassianWorld carrying only the attributes the first versions of this software set,
+             as unpickled from their files
+    """
+    jira = Jira.__new__(Jira)
+    jira.__dict__.update(url='https://jira.example.com', name='Jira', version=(0, 1, 0), user='admin',
+                         _logged_in=True, server=None, _api=None, _data={})
+    permissions = PermissionDict()
+    permissions.add_permission(PermissionEntry('Developers', {'alice'}, {'developers'}))
+    permissions.add_permission(PermissionEntry('Administrators', {'bob'}))
+    project = Project.__new__(Project)
+    project.__dict__.update(service=jira, data={'key': 'DEMO', 'name': 'Demo'}, _permissions=permissions)
+    jira.__dict__['_projects'] = {'DEMO': project}
+    world = MyLittleAtlassianWorld.__new__(MyLittleAtlassianWorld)
+    world.__dict__['services'] = {'Jira': jira}
+    return world
+
+
+@unittest.skipIf(dill is None, 'reading legacy pickles needs dill')
+class LegacyPickleTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.pickle')
+        with os.fdopen(fd, 'wb') as stream:
+            dill.dump(legacy_world(), stream)
+        self.addCleanup(os.remove, self.filename)
+
+    def test_load(self):
+        world = snapshot.load(self.filename)
+        self.assertEqual(list(world.flat_permissions), [
+            ('Jira', 'DEMO', 'Administrators', 'User', 'bob'),
+            ('Jira', 'DEMO', 'Developers', 'Group', 'developers'),
+            ('Jira', 'DEMO', 'Developers', 'User', 'alice'),
+        ])
+
+    def test_save_as_snapshot(self):
+        world = snapshot.load(self.filename)
+        world.logout()
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        snapshot.save(world, filename)
+        self.assertEqual(list(snapshot.load(filename).flat_permissions), list(world.flat_permissions))
+
+    def test_jira_logout(self):
+        jira = snapshot.load(self.filename).services['Jira']
+        self.assertIsNone(jira._roles)
+        jira.logout()
+        self.assertIsNone(jira._role_pool)
+
+    def test_query(self):
+        world = snapshot.load(self.filename)
+        stream = io.StringIO()
+        PrincipalQueryView(world, users=['alice'], groups=['developers']).write(stream)
+        self.assertEqual(stream.getvalue(), 'User alice:\n  Jira / DEMO / Developers\n'
+                                            'Group developers:\n  Jira / DEMO / Developers\n')
+
+
+class CarriedOverTest(unittest.TestCase):
+    def setUp(self):
+        previous = Jira('https://jira.example.com')
+        old = Project(previous, {'key': 'DEMO', 'name': 'Demo'})
+        old._permissions = PermissionDict()
+        old._permissions.add_permission(PermissionEntry('Developers', {'alice'}))
+        previous._projects = {'DEMO': old}
+        self.jira = Jira('https://jira.example.com')
+        self.jira._projects = {'DEMO': Project(self.jira, {'key': 'DEMO', 'name': 'Demo'}),
+                               'NEW': Project(self.jira, {'key': 'NEW', 'name': 'New'})}
+        with self.assertLogs('atlassian', 'WARNING'):
+            self.stale = self.jira.carry_over_permissions(previous)
+        self.world = MyLittleAtlassianWorld({'Jira': self.jira})
+
+    def test_marked(self):
+        self.assertEqual([project.key for project in self.stale], ['NEW'])
+        self.assertEqual(self.world.carried_over_projects, [('Jira', 'DEMO')])
+        self.assertTrue(str(self.jira._projects['DEMO']).startswith('DEMO (carried over): '))
+
+    def test_snapshot(self):
+        self.jira._projects['NEW']._permissions = PermissionDict()
+        stream = io.StringIO()
+        snapshot.dump(self.world, stream)
+        stream.seek(0)
+        self.assertEqual(snapshot.read(stream).carried_over_projects, [('Jira', 'DEMO')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+import unittest
+
+from requests.exceptions import Timeout
+
+from atlassian import HTTPClient
+from atlassian.confluence import Confluence
+from atlassian.scheduler import RequestScheduler
+
+
+class TimeoutTest(unittest.TestCase):
+    """Requests to a server that accepts connections but never answers"""
+
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)  # connections complete in the backlog, but nobody ever reads from them
+        self.addCleanup(self.server.close)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.getsockname()[1])
+        self.scheduler = RequestScheduler(max_retries=2, backoff=0.01)
+
+    def test_http_request_is_retried(self):
+        client = HTTPClient(self.url, scheduler=self.scheduler, timeout=0.2)
+        self.addCleanup(client.session.close)
+        with self.assertRaises(Timeout):
+            client.get('rest/api/2/project')
+        self.assertEqual(self.scheduler.retries, 2)
+
+    def test_xmlrpc_call_is_retried(self):
+        confluence = Confluence(self.url)
+        confluence.client_options.update(scheduler=self.scheduler, timeout=0.2)
+        with self.assertRaises(OSError):
+            confluence.login('admin', 'secret')
+        self.assertEqual(self.scheduler.retries, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
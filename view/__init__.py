@@ -2,7 +2,20 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
-from deepdiff import DeepDiff
+from collections import OrderedDict
+import gzip
+
+class MarkedEntry:
+    """
+    A permission entry whose assignees are marked as added or removed, for display only.
+    Unlike PermissionEntry, doesn't intern its names: marked names are never shared with the model.
+    """
+    __slots__ = ('name', 'users', 'groups')
+
+    def __init__(self, name, users, groups):
+        self.name = name
+        self.users = users
+        self.groups = groups
 
 
 class TextView(metaclass=ABCMeta):
@@ -63,8 +76,15 @@ class TextView(metaclass=ABCMeta):
         pass
 
     def export(self, filename):
-        with open(filename, 'w') as file:
-            file.write(self.output)
+        with open_output(filename) as file:
+            self.write(file)
+
+    def write(self, stream):
+        """
+        Write this view to a text stream.
+        Views that can render incrementally override this to avoid building the whole output in memory.
+        """
+        stream.write(self.output)
 
     def print(self):
         print(self.output)
@@ -80,48 +100,71 @@ class TextView(metaclass=ABCMeta):
         permdata = self.model.permissions
         metadata = dict()
 
-        contains_change = set()  # for diff only, we collect all containers actually containing changes
         if self.diff == "yes" or self.diff == "only":
-            olddata = self.cmp.permissions
-            diff = DeepDiff(olddata, permdata, default_view='ref')
-            if 'set_item_removed' in diff:
-                for change in diff['set_item_removed']:
-                    contains_change.add(change.up.up.t2)  # up from string to user/group set, up to PermissionEntry
-                    self.add_rem_parse(change)  # subclass implements to mark this item as removed
-            if 'set_item_added' in diff:
-                for change in diff['set_item_added']:
-                    contains_change.add(change.up.up.t2)  # up from string to user/group set, up to PermissionEntry
-                    self.add_rem_parse(change)  # subclass implements to mark this item as added
-
-        remove = list()
+            permdata = self._mark_changes(permdata, self.cmp.diff(self.model), only=(self.diff == "only"))
+
         if self.diff == "only":
             metadata['title'] = 'Atlassian permission change report'
             metadata['msg_no_data'] = "No changes"
-            for service_key, projects in permdata.items():
-                for project_key, permissions in projects.items():
-                    any_change = False
-                    for permission in permissions.values():
-                        if permission in contains_change:
-                            any_change = True
-                    if not any_change:
-                        # remove this project if none of its permissions (e.g. User, Developer...) has changes
-                        remove.append( (projects, project_key) )
-            for remove_from, item in remove:
-                del remove_from[item]
         else:
             metadata['title'] = 'Atlassian permissions'
 
+        carried_over = self.model.carried_over_projects
+        if carried_over:
+            self.msg_carried_over(metadata, carried_over)
+
         return permdata, metadata
 
     @classmethod
-    def add_rem_parse(cls, change):
-        parentset = change.up.t2
-
-        if change.report_type == 'set_item_added':
-            parentset.discard(change.t2)
-            parentset.add(cls.format_item_added(change.t2))
-        elif change.report_type == 'set_item_removed':
-            parentset.add(cls.format_item_removed(change.t1))
+    def _mark_changes(cls, permdata, diff, only=False):
+        """
+        Build a copy of permdata with all added and removed assignees marked
+        using format_item_added() and format_item_removed().
+        Projects and permissions that were removed are included, holding their removed assignees.
+        Entries of unchanged projects are shared with permdata, not copied.
+        :param diff: PermissionDiff from the compared model to ours
+        :param only: include changed projects only
+        """
+        changes = diff.by_project()
+        changed_projects = diff.changed_projects
+        service_keys = set(permdata.keys()) | {service for service, project in changed_projects}
+
+        result = OrderedDict()
+        for service_key in sorted(service_keys):
+            projects = permdata.get(service_key, OrderedDict())
+            project_keys = set(projects.keys()) | {project for service, project in changed_projects
+                                                   if service == service_key}
+            result[service_key] = OrderedDict()
+            for project_key in sorted(project_keys):
+                if (service_key, project_key) not in changed_projects:
+                    if not only:
+                        result[service_key][project_key] = projects[project_key]
+                    continue
+
+                assignees = dict()  # permission name -> (users, groups)
+                for name, entry in projects.get(project_key, dict()).items():
+                    assignees[name] = (set(entry.users), set(entry.groups))
+                for change, name, type, assignee in changes.get((service_key, project_key), ()):
+                    if name not in assignees:
+                        assignees[name] = (set(), set())
+                    users, groups = assignees[name]
+                    marked = users if type == 'User' else groups
+                    if change == diff.ADDED:
+                        marked.discard(assignee)
+                        marked.add(cls.format_item_added(assignee))
+                    else:
+                        marked.add(cls.format_item_removed(assignee))
+                result[service_key][project_key] = OrderedDict(
+                    (name, MarkedEntry(name, *assignees[name])) for name in sorted(assignees.keys()))
+        return result
+
+    @staticmethod
+    def format_item_added(item):
+        return "+" + item
+
+    @staticmethod
+    def format_item_removed(item):
+        return "-" + item
 
     @classmethod
     def msg_compare_partially_unparsable(cls, metadata):
@@ -132,9 +175,20 @@ class TextView(metaclass=ABCMeta):
         cls.msg_header(metadata, 'cmp_partially_unparsable',
                        "Compare data (partially) unparsable. " +
                        "Please ensure the old data was recorded using the same version " +
-                       "of this software. Note this software can not currently display " +
-                       "added, renamed or removed projects.")
+                       "of this software.")
+
 
+    @classmethod
+    def msg_carried_over(cls, metadata, projects):
+        """
+        Call msg_header and write a header message telling the user
+        that an incremental crawl did not check the permissions of these projects.
+        :param projects: (service key, project key) pairs, see MyLittleAtlassianWorld.carried_over_projects
+        """
+        cls.msg_header(metadata, 'carried_over',
+                       "The permissions of {} unchanged projects were carried over from an earlier crawl ".format(len(projects)) +
+                       "without checking them: " + ", ".join("{} / {}".format(*project) for project in projects) + ". " +
+                       "Changes to their permissions alone are only picked up by a full crawl.")
 
     @classmethod
     def msg_header(cls, metadata, name, text):
@@ -144,3 +198,12 @@ class TextView(metaclass=ABCMeta):
         if 'header_messages' not in metadata:
             metadata['header_messages'] = dict()
         metadata['header_messages'][name] = text
+
+
+def open_output(filename):
+    """
+    Open an output file for writing text. Output is gzip compressed if filename ends in .gz.
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', encoding='utf-8', newline='')
+    return open(filename, 'w', encoding='utf-8', newline='')
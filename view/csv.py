@@ -1,20 +1,145 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import csv, io
+import csv, io, sys
+from itertools import islice
+from threading import Lock
 
 from . import TextView
 
 
+HEADER = ["Product", "Project", "Permission", "Type", "Assignee"]
+EFFECTIVE_HEADER = ["Product", "Project", "Permission", "User", "Via group"]
+
+
 class WorldCsvView(TextView):
-    def __init__(self, my_little_atlassian_world):
+    CHUNK_SIZE = 1000
+    """Number of rows we hand to the CSV writer at once"""
+
+    def __init__(self, my_little_atlassian_world, diff=None, cmp=None):
+        super().__init__(my_little_atlassian_world, diff, cmp)
+
+    def generate(self, header=True, dialect='unix'):
+        output = io.StringIO()
+        self.write(output, header, dialect)
+        self._output = output.getvalue()
+
+    def write(self, stream, header=True, dialect='unix'):
+        """
+        Write CSV rows directly to stream, a chunk at a time, without keeping the whole report in memory.
+        """
+        writer = csv.writer(stream, dialect=dialect)
+        if self.diff == "no":
+            if header:  # first CSV line shall contain column headers
+                writer.writerow(HEADER)
+            lines = self.model.flat_permissions
+        else:
+            if header:
+                writer.writerow(["Change"] + HEADER)
+            lines = self._diff_lines()
+        while True:
+            chunk = list(islice(lines, self.CHUNK_SIZE))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+
+    def print(self):
+        self.write(sys.stdout)
+
+    def _diff_lines(self):
+        """
+        Yield CSV lines for a comparison: changes only (diff="only")
+        or all current assignments with removed ones mixed in (diff="yes").
+        Change is "+" for added, "-" for removed and empty for unchanged assignments.
+        Added and removed projects and permissions are listed with empty type and assignee.
+        """
+        diff = self.cmp.diff(self.model)
+        changes = [(change, service, project, permission or '', type or '', assignee or '')
+                   for change, service, project, permission, type, assignee in diff.changes()]
+        if self.diff == "only":
+            yield from changes
+            return
+
+        unchanged = (('', service_key, project, permission, type, assignee)
+                     for service_key, service in sorted(self.model.services.items())
+                     for project, permission, type, assignee in service.flat_permissions
+                     if (service_key, project, permission, type, assignee) not in diff.added)
+        yield from sorted(list(unchanged) + changes, key=lambda line: (line[1:], line[0]))
+
+
+class EffectiveCsvView(TextView):
+    """
+    Lists effective permissions: one row for every user holding a permission, directly or through a group.
+    "Via group" names the group granting it, empty for direct grants.
+    Groups whose members couldn't be looked up are listed with an empty user.
+    """
+    CHUNK_SIZE = 1000
+    """Number of rows we hand to the CSV writer at once"""
+
+    def __init__(self, my_little_atlassian_world, membership):
+        """
+        :param membership: loaded GroupMembership of my_little_atlassian_world
+        """
         super().__init__(my_little_atlassian_world)
+        self.membership = membership
 
     def generate(self, header=True, dialect='unix'):
         output = io.StringIO()
-        writer = csv.writer(output, dialect=dialect)
-        if header:  # first CSV line shall contain column headers
-            writer.writerow(["Product", "Project", "Permission", "Type", "Assignee"])
-        for line in self.model.flat_permissions:
-            writer.writerow(line)
+        self.write(output, header, dialect)
         self._output = output.getvalue()
+
+    def write(self, stream, header=True, dialect='unix'):
+        writer = csv.writer(stream, dialect=dialect)
+        if header:
+            writer.writerow(EFFECTIVE_HEADER)
+        lines = self._lines()
+        while True:
+            chunk = list(islice(lines, self.CHUNK_SIZE))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+
+    def print(self):
+        self.write(sys.stdout)
+
+    def _lines(self):
+        for service_key in sorted(self.model.services.keys()):
+            service = self.model.services[service_key]
+            for project_key in service.sorted_project_keys():
+                for permission_name, entry in service.projects[project_key].permissions.sorted_items():
+                    for user, group in self.membership.effective_users(service_key, entry):
+                        yield service.name, project_key, permission_name, user or '', group or ''
+
+
+class CrawlCsvWriter:
+    """
+    Writes CSV rows for each project as soon as its permissions are loaded, i.e. while a crawl is still running.
+    Register it as listener on all services before crawling, see Service.add_listener().
+    Rows are written in the order projects finish loading, not sorted.
+    """
+
+    def __init__(self, stream, header=True, dialect='unix'):
+        self.writer = csv.writer(stream, dialect=dialect)
+        self.stream = stream
+        self._lock = Lock()
+        self._written = set()
+        """(service, project) keys of all projects we have written"""
+        if header:
+            self.writer.writerow(HEADER)
+
+    def __call__(self, service, project):
+        rows = [(service.name, project.key) + line for line in project.permissions.flatten()]
+        with self._lock:  # projects may finish loading on several worker threads at once
+            self.writer.writerows(rows)
+            self._written.add((service.name, project.key))
+
+    def finish(self, world):
+        """
+        Write all projects of world we have not been notified about,
+        e.g. those carried over in an incremental crawl.
+        """
+        for service_key in sorted(world.services.keys()):
+            service = world.services[service_key]
+            for project_key in service.sorted_project_keys():
+                if (service.name, project_key) not in self._written:
+                    self(service, service.projects[project_key])
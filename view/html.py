@@ -1,20 +1,56 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+from itertools import islice
+import logging
 import os
+from threading import Lock
 import jinja2
 
-from . import TextView
+from . import TextView, open_output
+
+
+l = logging.getLogger(__name__)
+
+_environments = dict()
+"""Jinja2 Environments by template directory, shared by all views so each template is compiled only once"""
+_environments_lock = Lock()
+
+
+def get_environment(template_dir):
+    """
+    :return: The shared Jinja2 Environment for templates in template_dir.
+             Compiled templates are cached on disk, so later runs skip compiling them, too.
+    """
+    with _environments_lock:
+        if template_dir not in _environments:
+            try:
+                bytecode_cache = jinja2.FileSystemBytecodeCache()
+            except (OSError, RuntimeError) as e:  # no usable temporary directory
+                l.info('Not caching compiled templates: %s', e)
+                bytecode_cache = None
+            environment = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir),
+                                             bytecode_cache=bytecode_cache)
+            environment.line_statement_prefix = '%%'
+            environment.line_comment_prefix = '##'
+            _environments[template_dir] = environment
+        return _environments[template_dir]
 
 
 class WorldHtmlView(TextView):
-    def __init__(self, my_little_atlassian_world, diff=None, cmp=None, template_filename='world_template.html.j2', template_dir=None):
+    BUFFER_SIZE = 100
+    """Number of template output fragments to collect before writing them to our output stream"""
+
+    def __init__(self, my_little_atlassian_world, diff=None, cmp=None, template_filename='world_template.html.j2', template_dir=None,
+                 index_template_filename='index_template.html.j2'):
         super().__init__(my_little_atlassian_world, diff, cmp)
 
         self.environment = None
         """Jinja2 Environment (this generates the template object)"""
 
         self.template_filename = template_filename
+        self.index_template_filename = index_template_filename
 
         # self.template_dir
         """In which directory to look for Jinja2 templates. Default to the directory this Python file is in."""
@@ -29,20 +65,85 @@ class WorldHtmlView(TextView):
         self.initialize_template()
 
     def initialize_template(self):
-        loader = jinja2.FileSystemLoader(self.template_dir)
-        self.environment = jinja2.Environment(loader=loader)
-        self.environment.line_statement_prefix = '%%'
-        self.environment.line_comment_prefix = '##'
+        self.environment = get_environment(self.template_dir)
         self.template = self.environment.get_template(self.template_filename)
 
     def generate(self):
         permdata, metadata = self._prepare_data_for_generate()
         self._output = self.template.render(permdata=permdata, metadata=metadata)
 
+    def write(self, stream):
+        """
+        Render straight into stream, without building the whole report in memory.
+        """
+        if self._output is not None:
+            stream.write(self._output)
+            return
+        permdata, metadata = self._prepare_data_for_generate()
+        self._stream(self.template, stream, permdata=permdata, metadata=metadata)
+
+    def export_pages(self, filename, projects_per_page=None):
+        """
+        Split this report into several HTML files, for reports too large for a single page:
+        an index page at filename linking to one page per service, or, if projects_per_page is set,
+        to pages of at most that many projects each. Pages are written next to the index,
+        named after it, e.g. report-Jira-1.html for an index report.html.
+        """
+        permdata, metadata = self._prepare_data_for_generate()
+        directory = os.path.dirname(filename)
+        stem, suffix = self._split_filename(os.path.basename(filename))
+
+        index = []  # (service key, [(page file name, first project, last project, number of projects)])
+        for service_key, projects in permdata.items():
+            pages = []
+            project_items = iter(projects.items())
+            number = 0
+            while True:
+                page = OrderedDict(islice(project_items, projects_per_page))
+                if not page and number > 0:
+                    break
+                number += 1
+                page_filename = '{}-{}-{}{}'.format(stem, self._slug(service_key), number, suffix)
+                keys = list(page.keys())
+                pages.append((page_filename, keys[0] if keys else None, keys[-1] if keys else None, len(keys)))
+                page_metadata = dict(metadata, index=os.path.basename(filename))
+                page_metadata['title'] = '{}: {}{}'.format(metadata['title'], service_key,
+                                                           ' ({})'.format(number) if projects_per_page else '')
+                with open_output(os.path.join(directory, page_filename)) as stream:
+                    self._stream(self.template, stream, permdata=OrderedDict([(service_key, page)]),
+                                 metadata=page_metadata)
+                if not projects_per_page:
+                    break
+            index.append((service_key, pages))
+
+        with open_output(filename) as stream:
+            self._stream(self.environment.get_template(self.index_template_filename), stream,
+                         index=index, metadata=metadata)
+
+    def _stream(self, template, stream, **context):
+        template_stream = template.stream(**context)
+        template_stream.enable_buffering(self.BUFFER_SIZE)
+        template_stream.dump(stream)
+
+    @staticmethod
+    def _split_filename(filename):
+        """
+        :return: filename without and with its extension, e.g. ('report', '.html.gz') for report.html.gz
+        """
+        suffix = ''
+        for extension in ('.gz', '.html', '.htm'):
+            if filename.endswith(extension):
+                filename, suffix = filename[:-len(extension)], extension + suffix
+        return filename, suffix or '.html'
+
+    @staticmethod
+    def _slug(text):
+        return ''.join(c if c.isalnum() or c in '-_' else '_' for c in text)
+
     @staticmethod
     def format_item_added(item):
         return "<ins>" + item + "</ins>"
 
     @staticmethod
     def format_item_removed(item):
-        return "<del>" + item + "</del>"
\ No newline at end of file
+        return "<del>" + item + "</del>"
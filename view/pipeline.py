@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+
+class SortedWorld:
+    """
+    Read-only stand-in for a MyLittleAtlassianWorld that sorts the world once and shares the result
+    with all views drawing from it, instead of every view sorting services, projects and permissions again.
+    Also computes each diff against it only once. Anything else is passed through to the world.
+    Don't modify the world while views are drawing from this.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.permissions = world.permissions
+        """Like MyLittleAtlassianWorld.permissions, sorted once"""
+        self._diffs = dict()
+        """PermissionDiffs from us to other worlds, by id() of the other world"""
+        self._lock = Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.world, name)
+
+    def __str__(self):
+        return str(self.world)
+
+    @property
+    def flat_permissions(self):
+        """Like MyLittleAtlassianWorld.flat_permissions, without sorting anything but the assignees again"""
+        for service_key, projects in self.permissions.items():
+            service_name = self.world.services[service_key].name
+            for project_key, permissions in projects.items():
+                for entry in permissions.values():
+                    for permission_name, type, assignee in entry.flatten():
+                        yield service_name, project_key, permission_name, type, assignee
+
+    def diff(self, other):
+        """
+        Like MyLittleAtlassianWorld.diff(), computed once per other world, no matter how many views ask.
+        """
+        with self._lock:
+            if id(other) not in self._diffs:
+                self._diffs[id(other)] = (other, self.world.diff(other))  # keep other alive so its id stays unique
+            return self._diffs[id(other)][1]
+
+
+class RenderPipeline:
+    """
+    Renders several views of the same world at once: the world is sorted a single time and shared by all views,
+    see SortedWorld, and views writing to files render concurrently on worker threads.
+    Views printing to the console run one after the other, so their output doesn't interleave.
+    """
+
+    def __init__(self, world, cmp=None, workers=None):
+        """
+        :param cmp: another world views should compare to, if any
+        :param workers: maximum number of views to render at once. Default: all of them.
+        """
+        self.model = SortedWorld(world)
+        """Model to pass to views"""
+        self.cmp = SortedWorld(cmp) if cmp is not None else None
+        """World to compare to, to pass to views"""
+        self.workers = workers
+        self._concurrent = []
+        self._sequential = []
+
+    def add(self, job, concurrent=True):
+        """
+        Add a rendering job.
+        :param job: function rendering a view, called without arguments
+        :param concurrent: whether job may run concurrently with other jobs
+        """
+        (self._concurrent if concurrent else self._sequential).append(job)
+
+    def run(self):
+        """
+        Run all jobs and wait for them to finish. Raises the first error of any job, after all jobs are done.
+        """
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers or max(1, len(self._concurrent))) as pool:
+            for job in self._concurrent:
+                futures.append(pool.submit(job))
+            for job in self._sequential:
+                job()
+        for future in futures:
+            future.result()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+
+from . import TextView
+
+
+class PrincipalQueryView(TextView):
+    """
+    Lists everything the queried users and groups were granted, across all services, e.g.:
+
+    User alice:
+      Jira / DEMO / Developers
+      Stash / DEMO:website / REPO_WRITE (via group website-devs)
+    """
+
+    def __init__(self, my_little_atlassian_world, users=(), groups=(), membership=None):
+        """
+        :param membership: loaded GroupMembership. If set, users' permissions include those granted to their groups.
+        """
+        super().__init__(my_little_atlassian_world)
+        self.users = users
+        self.groups = groups
+        self.membership = membership
+
+    def generate(self):
+        self._output = "".join(self._chunks())
+
+    def write(self, stream):
+        for chunk in self._chunks():
+            stream.write(chunk)
+
+    def print(self):
+        self.write(sys.stdout)
+
+    def _chunks(self):
+        index = self.model.permission_index
+        if self.membership is not None:
+            user_lookup = self.membership.effective_grants
+        else:
+            user_lookup = lambda name: [grant + (None,) for grant in index.user(name)]
+        group_lookup = lambda name: [grant + (None,) for grant in index.group(name)]
+        for type, names, lookup in (('User', self.users, user_lookup), ('Group', self.groups, group_lookup)):
+            for name in names:
+                yield '{} {}:\n'.format(type, name)
+                grants = lookup(name)
+                if not grants:
+                    yield '  No permissions\n'
+                for service, project, permission, group in grants:
+                    if group is None:
+                        yield '  {} / {} / {}\n'.format(service, project, permission)
+                    else:
+                        yield '  {} / {} / {} (via group {})\n'.format(service, project, permission, group)
@@ -1,14 +1,44 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from pprint import pformat
+import sys
 
 from . import TextView
 
 
 class WorldTextView(TextView):
-    def __init__(self, my_little_atlassian_world):
-        super().__init__(my_little_atlassian_world)
+    def __init__(self, my_little_atlassian_world, diff=None, cmp=None):
+        super().__init__(my_little_atlassian_world, diff, cmp)
 
     def generate(self):
-        self._output = str(self.model)
+        self._output = "".join(self._chunks())
+
+    def write(self, stream):
+        """
+        Write this view to stream piece by piece, in a single pass and without building it in memory first.
+        """
+        if self._output is not None:
+            stream.write(self._output)
+            return
+        for chunk in self._chunks():
+            stream.write(chunk)
+
+    def print(self):
+        self.write(sys.stdout)
+        sys.stdout.write("\n")
+
+    def _chunks(self):
+        if self.diff == "no":
+            yield from self.model.iter_text()
+        else:  # list changes only
+            diff = self.cmp.diff(self.model)
+            if not diff:
+                yield str(diff)
+                return
+            first = True
+            for line in diff.lines():
+                if first:
+                    first = False
+                else:
+                    yield "\n"
+                yield line